@@ -1,454 +1,370 @@
+import os
 import numpy as np
 import pandas as pd
-from tqdm import tqdm
 import gc
-import re
-from collections import defaultdict
 import matplotlib.pyplot as plt
 
 # from nltk import sent_tokenize, word_tokenize
 # nltk.download('stopwords')
 # from nltk.corpus import stopwords
-from nltk.stem import PorterStemmer
 
-from sklearn.preprocessing import LabelEncoder
 from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.metrics import roc_auc_score
 from sklearn.model_selection import RepeatedKFold
 
-# Sentiment Analysis
-from textblob import TextBlob
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-
 # Light GBM
-import lightgbm as lgb
-
-# Folder containing data
-DATA_PATH = 'C:/Users/Dave/Google Drive/Data Science Training/Python Scripts/Donors Choose/'
-
-# Definitions
-
-
-def process_timestamp(df):
-    df['year'] = df['project_submitted_datetime'].\
-        apply(lambda x: int(x.split('-')[0]))
-
-    df['month'] = df['project_submitted_datetime'].\
-        apply(lambda x: int(x.split('-')[1]))
-
-    df['day_of_week'] = pd.to_datetime(df['project_submitted_datetime']
-                                       ).dt.weekday
-
-    df['hour'] = df['project_submitted_datetime'].\
-        apply(lambda x: int(x.split(' ')[-1].split(':')[0]))
-
-    df['minute'] = df['project_submitted_datetime'].\
-        apply(lambda x: int(x.split(' ')[-1].split(':')[1]))
-
-    df['project_submitted_datetime'] =\
-        pd.to_datetime(df['project_submitted_datetime']).\
-        values.astype(np.int64)
-    return df
-
-
-def extract_features(df):
-    df['project_title_len'] = df['project_title'].apply(lambda x: len(str(x)))
-    df['project_essay_1_len'] = df['project_essay_1'].\
-        apply(lambda x: len(str(x)))
-    df['project_essay_2_len'] = df['project_essay_2'].\
-        apply(lambda x: len(str(x)))
-    df['project_essay_3_len'] = df['project_essay_3'].\
-        apply(lambda x: len(str(x)))
-    df['project_essay_4_len'] = df['project_essay_4'].\
-        apply(lambda x: len(str(x)))
-    df['project_resource_summary_len'] = df['project_resource_summary'].\
-        apply(lambda x: len(str(x)))
-
-    df['project_title_wc'] = df['project_title'].\
-        apply(lambda x: len(str(x).split(' ')))
-    df['project_essay_1_wc'] = df['project_essay_1'].\
-        apply(lambda x: len(str(x).split(' ')))
-    df['project_essay_2_wc'] = df['project_essay_2'].\
-        apply(lambda x: len(str(x).split(' ')))
-    df['project_essay_3_wc'] = df['project_essay_3'].\
-        apply(lambda x: len(str(x).split(' ')))
-    df['project_essay_4_wc'] = df['project_essay_4'].\
-        apply(lambda x: len(str(x).split(' ')))
-    df['project_resource_summary_wc'] = df['project_resource_summary'].\
-        apply(lambda x: len(str(x).split(' ')))
-    return df
-
-
-def get_polarity(text):
-    textblob = TextBlob(text)
-    pol = round(textblob.sentiment.polarity, 2)
-    return pol
-
-
-def get_subjectivity(text):
-    textblob = TextBlob(text)
-    subj = round(textblob.sentiment.subjectivity, 2)
-    return subj
-
-
-def get_vader_polarity(text):
-    analyzer = SentimentIntensityAnalyzer()
-    pol = analyzer.polarity_scores(text)
-    pol = list(pol.values())
-    return pol
-
-
-def count_characters(df):
-    KeyChars = ['!', '\?', '@', '#', '\$', '%', '&', '\*', '\(', '\[',
-                '\{', '\|', '-', '_', '=', '\+', '\.', ':', ';', ',', '/',
-                '\\\\r', '\\\\t', '\\"', '\.\.\.', 'etc', 'http']
-    for c in KeyChars:
-        df['n_' + c] = df['text'].\
-        apply(lambda x: len(re.findall(c, x.lower())))
-    return df
-
-# Desired data types to read in training csv
-
-
-dtypes = {
-    'id': 'str',
-    'project_id': 'str',
-    'project_title': 'str',
-    'project_grade_category': 'str',
-    'project_subject_categories': 'str',
-    'school_state': 'str',
-    'project_subject_subcategories': 'str',
-    'project_resource_summary': 'str',
-    'project_essay_1': 'str',
-    'project_essay_2': 'str',
-    'project_essay_3': 'str',
-    'project_essay_4': 'str',
-    'project_submitted_datetime': 'str',
-    'teacher_id': 'str',
-    'teacher_prefix': 'str',
-    'teacher_number_of_previously_posted_projects': 'uint64',
-    'project_is_approved': 'uint8',
-    }
-
-print('Read Data...')
-
-df_train = pd.read_csv(DATA_PATH + 'train.csv', dtype=dtypes)
-df_test = pd.read_csv(DATA_PATH + 'test.csv')
-df_all = pd.concat([df_train, df_test], axis=0)
-
-dtypes_resources = {
-    'id': 'str',
-    'description': 'str',
-    'quantity': 'uint32',
-    'price': 'float32'
-    }
-
-resouces = pd.read_csv(DATA_PATH + 'resources.csv',
-                       usecols=['id', 'quantity', 'price'],
-                       dtype=dtypes_resources)
-
-
-resouces = pd.DataFrame(resouces.groupby('id').agg(
-    {
-        'quantity': [
-            'sum',
-            'min',
-            'max',
-            'mean',
-            'std',
-            # lambda x: len(np.unique(x)),
-        ],
-        'price': [
-            'count',
-            'sum',
-            'min',
-            'max',
-            'mean',
-            'std',
-            lambda x: len(np.unique(x)),
-        ]}
-    )).reset_index()
-
-resouces.columns = ['_'.join(col) for col in resouces.columns]
-resouces.rename(columns={'id_': 'id'}, inplace=True)
-resouces['mean_price'] = resouces['price_sum'] / resouces['quantity_sum']
-
-assert((df_train.shape[0] + df_test.shape[0]) == resouces.shape[0])
-resouces.head()
-
-# Join resources with training / test
-df_train = pd.merge(df_train, resouces, on='id', how='left')
-df_test = pd.merge(df_test, resouces, on='id', how='left')
-
-del resouces
-gc.collect()
+from cv_runner import run_cv
 
-# Preprocess categorical columns
-print('Preprocess Data...')
+# Categorical encoding
+from categorical import CategoricalEncoder
 
-cols = [
-    'teacher_id',
-    'teacher_prefix',
-    'school_state',
-    'project_grade_category',
-    'project_subject_categories',
-    'project_subject_subcategories'
-]
-
-for column in tqdm(cols):
-    le = LabelEncoder()
-    le.fit(df_train[column].astype(str))
-    df_train[column] = le.transform(df_train[column].astype(str))
-
-for column in tqdm(cols):
-    le = LabelEncoder()
-    le.fit(df_test[column].astype(str))
-    df_test[column] = le.transform(df_test[column].astype(str))
-
-del le
-gc.collect()
-
-# Preprocess timestamp
-
-df_train = process_timestamp(df_train)
-df_test = process_timestamp(df_test)
-
-# Extract featuretures from the text: Charcter legth and word count
-# of each essay
-
-df_train = extract_features(df_train)
-df_test = extract_features(df_test)
-
-# Combine text fileds into single string
-
-df_train['text'] = df_train.apply(lambda row: ''.join([
-    str(row['project_title']), ' ',
-    str(row['project_resource_summary']), ' ',
-    str(row['project_essay_1']), ' ',
-    str(row['project_essay_2']), ' ',
-    str(row['project_essay_3']), ' ',
-    str(row['project_essay_4'])
-    ]), axis=1)
-
-df_test['text'] = df_test.apply(lambda row: ''.join([
-    str(row['project_title']), ' ',
-    str(row['project_resource_summary']), ' ',
-    str(row['project_essay_1']), ' ',
-    str(row['project_essay_2']), ' ',
-    str(row['project_essay_3']), ' ',
-    str(row['project_essay_4'])
-    ]), axis=1)
-
-# Extract featuretures from the text: count of Key Characters
-
-df_train = count_characters(df_train)
-df_test = count_characters(df_test)
-
-# Extract text polarity and subjectivity using TextBlob
-print('Extracting text sentiment: TextBlob...')
-
-df_train['text_polarity_TB'] = df_train.text.apply(get_polarity)
-df_train['text_subj_TB'] = df_train.text.apply(get_subjectivity)
-
-df_test['text_polarity'] = df_test.text.apply(get_polarity)
-df_test['text_subj'] = df_test.text.apply(get_subjectivity)
-
-# Extract  text polarity using Vader Sentiment analysis
-print('Extracting text sentiment: VADER...')
-
-df_train['text_polarity_Vader'] = df_train.text.apply(get_vader_polarity)
-df_test['text_polarity_Vader'] = df_test.text.apply(get_vader_polarity)
-
-df_train[['tp_vader_compond', 'tp_vader_neg', 'tp_vader_neu', 'tp_vader_pos']]\
-        = pd.DataFrame(df_train.text_polarity_Vader.values.tolist(),
-                       index=df_train.index)
-df_test[['tp_vader_compond', 'tp_vader_neg', 'tp_vader_neu', 'tp_vader_pos']]\
-        = pd.DataFrame(df_test.text_polarity_Vader.values.tolist(),
-                       index=df_test.index)
-df_train.head()
-
-# Clean up dataframe
-print('Cleaning Up...')
-
-df_train.drop([
-    'project_title',
-    'project_resource_summary',
-    'project_essay_1',
-    'project_essay_2',
-    'project_essay_3',
-    'project_essay_4',
-    'text_polarity_Vader'], axis=1, inplace=True)
-df_test.drop([
-    'project_title',
-    'project_resource_summary',
-    'project_essay_1',
-    'project_essay_2',
-    'project_essay_3',
-    'project_essay_4',
-    'text_polarity_Vader'], axis=1, inplace=True)
-
-df_all = pd.concat([df_train, df_test], axis=0)
-
-gc.collect()
+# Checkpoints of the feature matrices
+from checkpoints import CheckpointStore
 
+# Sparse feature matrices
+from feature_matrix import frame_to_csr, hstack_features
 
-# Text Vecorizer #
-print('Vectorize Text...')
+# Preprocessing stages, and the modules doing their work (their code is
+# part of each stage's fingerprint)
+from pipeline import Pipeline
+import categorical
+import datetime_features
+import feature_cache
+import feature_matrix
+import loader
+import resources
+import text_features
 
-n_features = 1000
+# Data loading
+from loader import load_table, TRAIN_DTYPES, TEST_DTYPES
 
-# tfidf = TfidfVectorizer(
-#         max_features=n_features,
-#         norm='l2',
-#         )
+# Resource aggregates
+from resources import aggregate_resources
 
-p = PorterStemmer()
+# Text feature extraction
+from text_features import stem_texts, CombinedText, KEY_CHARS_VERSION, \
+    SENTIMENT_VERSION
+from feature_cache import FeatureCache
 
+# Row-local feature blocks, and out-of-core featurization
+from streaming import timestamp_block, text_stats_block, key_chars_block, \
+    sentiment_block, fit_vocabularies, stream_featurize, load_streamed, \
+    NUMERIC_COLUMNS
 
-def wordPreProcess(text):
-    return ' '.join([p.stem(x.lower()) for x in re.split('\W', text)
-                     if len(x) >= 1])
-
-
-count_vec = CountVectorizer(stop_words=None,
-                            preprocessor=wordPreProcess,
-                            max_features=n_features,
-                            binary=True,
-                            ngram_range=(1, 2))
+# Folder containing data
+DATA_PATH = 'C:/Users/Dave/Google Drive/Data Science Training/Python Scripts/Donors Choose/'
 
+# Worker processes for the text features. Spawned workers (Windows) re-run
+# this script, so only fan out where processes are forked.
+N_JOBS = os.cpu_count() if os.name != 'nt' else 1
 
-count_vec.fit(df_all.text)
+# Parquet copies of the csv files
+CACHE_PATH = DATA_PATH + 'cache/'
 
-count_vec_train = np.array(count_vec.transform(df_train.text).
-                           toarray(), dtype=np.float16)
-count_vec_test = np.array(count_vec.transform(df_test.text).
-                          toarray(), dtype=np.float16)
+# Feature matrices saved before modelling
+CHECKPOINT_PATH = DATA_PATH + 'checkpoints/'
 
-for i in range(n_features):
-    df_train['count_vec_' + str(i)] = count_vec_train[:, i]
-    df_test['count_vec_' + str(i)] = count_vec_test[:, i]
+# Load the feature matrices from the checkpoint, if there is one, instead of
+# featurizing again
+RESUME = False
 
-del count_vec_train, count_vec_test
-gc.collect()
+# Text features already computed, keyed by a hash of each text
+FEATURE_CACHE = DATA_PATH + 'feature_cache/'
 
-# Set up training and test sets
-# df_train = pd.read_csv('C:/Users/Dave/Google Drive/Data Science Training/Python Scripts/Donors Choose/train_preprocessed2.csv', encoding = "ISO-8859-1")
-# df_test = pd.read_csv('C:/Users/Dave/Google Drive/Data Science Training/Python Scripts/Donors Choose/test_preprocessed2.csv', encoding = "ISO-8859-1")
+# Cached results of the preprocessing stages
+STAGE_CACHE = DATA_PATH + 'stages/'
 
-df_train.to_csv('C:/Users/Dave/Google Drive/Data Science Training/Python Scripts/Donors Choose/train_preprocessed_vec.csv')
-df_test.to_csv('C:/Users/Dave/Google Drive/Data Science Training/Python Scripts/Donors Choose/test_preprocessed_vec.csv')
+# Featurize in chunks of rows straight to disk, for data larger than memory
+STREAMING = False
+STREAM_PATH = DATA_PATH + 'streamed/'
 
-cols_to_drop = [
-    'id',
+# Categorical columns, encoded with one vocabulary over train and test
+cols = [
     'teacher_id',
-    'text',
-    'project_is_approved'
-    ]
-
-X = df_train.drop(cols_to_drop, axis=1, errors='ignore')
-y = df_train['project_is_approved']
+    'teacher_prefix',
+    'school_state',
+    'project_grade_category',
+    'project_subject_categories',
+    'project_subject_subcategories'
+]
 
-X_test = df_test.drop(cols_to_drop, axis=1, errors='ignore')
-id_test = df_test['id'].values
-feature_names = list(X.columns)
+# Handed to LightGBM as native categorical features
+categorical_features = [c for c in cols if c != 'teacher_id']
+
+# Preprocessing stages. Each one takes the outputs of earlier stages and
+# returns its own (train, test) blocks of features; results are cached, so
+# changing a stage, or a module listed in its code, only re-runs it and the
+# stages that use its outputs. Stages fanning out to N_JOBS processes are
+# exclusive, so only one of them runs at a time
+
+pipeline = Pipeline(STAGE_CACHE, max_workers=4)
+
+
+@pipeline.stage(outputs=['df_train', 'df_test'],
+                sources=[DATA_PATH + 'train.csv', DATA_PATH + 'test.csv'],
+                cache=False, code=[loader])
+def read_data():
+    print('Read Data...')
+
+    # Typed, Arrow-backed columns; parsed csvs are cached as Parquet
+    df_train = load_table(DATA_PATH + 'train.csv', TRAIN_DTYPES,
+                          cache_dir=CACHE_PATH)
+    df_test = load_table(DATA_PATH + 'test.csv', TEST_DTYPES,
+                         cache_dir=CACHE_PATH)
+    return df_train, df_test
+
+
+@pipeline.stage(inputs=['df_train', 'df_test'],
+                outputs=['resources_train', 'resources_test'],
+                sources=[DATA_PATH + 'resources.csv'], code=[resources])
+def join_resources(df_train, df_test):
+    # Sum / min / max / mean / std / count / nunique per id, read in chunks
+    resouces = aggregate_resources(DATA_PATH + 'resources.csv')
+
+    assert((df_train.shape[0] + df_test.shape[0]) == resouces.shape[0])
+
+    # Join resources with training / test
+    return [pd.merge(df[['id']], resouces, on='id', how='left').
+            drop(columns='id').set_index(df.index)
+            for df in (df_train, df_test)]
+
+
+@pipeline.stage(inputs=['df_train', 'df_test'],
+                outputs=['categorical_train', 'categorical_test'],
+                code=[categorical])
+def encode_categoricals(df_train, df_test):
+    # One vocabulary over train and test, so codes match between them.
+    # Saved to encode new applications the same way
+    encoder = CategoricalEncoder(cols).fit(df_train, df_test)
+    encoder.save(DATA_PATH + 'categories.json')
+
+    return [encoder.transform(df[cols].copy()) for df in (df_train, df_test)]
+
+
+@pipeline.stage(inputs=['df_train', 'df_test'],
+                outputs=['timestamps_train', 'timestamps_test'],
+                code=[timestamp_block, datetime_features])
+def process_timestamp(df_train, df_test):
+    # Calendar, cyclic and holiday features; the timestamp itself becomes
+    # its epoch in nanoseconds
+    return [timestamp_block(df) for df in (df_train, df_test)]
+
+
+@pipeline.stage(inputs=['df_train', 'df_test'],
+                outputs=['text_stats_train', 'text_stats_test'],
+                code=[text_stats_block, text_features])
+def extract_features(df_train, df_test):
+    # Length, word count and sentence count of each text field
+    return [text_stats_block(df) for df in (df_train, df_test)]
+
+
+@pipeline.stage(inputs=['df_train', 'df_test'],
+                outputs=['key_chars_train', 'key_chars_test'],
+                version=KEY_CHARS_VERSION,
+                code=[key_chars_block, text_features, feature_cache],
+                exclusive=True)
+def count_characters(df_train, df_test):
+    # Count all 27 key characters in one pass per essay, as a uint16 block.
+    # The combined text is built chunk by chunk as it is read
+    cache = FeatureCache(FEATURE_CACHE, 'key_chars', KEY_CHARS_VERSION)
+    return [key_chars_block(df, cache, N_JOBS) for df in (df_train, df_test)]
+
+
+@pipeline.stage(inputs=['df_train', 'df_test'],
+                outputs=['sentiment_train', 'sentiment_test'],
+                version=SENTIMENT_VERSION,
+                code=[sentiment_block, text_features, feature_cache],
+                exclusive=True)
+def text_sentiment(df_train, df_test):
+    # Text polarity and subjectivity using TextBlob, and text polarity
+    # using Vader Sentiment analysis, as a float32 block
+    print('Extracting text sentiment: TextBlob & VADER...')
+
+    cache = FeatureCache(FEATURE_CACHE, 'sentiment', SENTIMENT_VERSION)
+    return [sentiment_block(df, cache, N_JOBS) for df in (df_train, df_test)]
+
+
+@pipeline.stage(inputs=['df_train', 'df_test'],
+                outputs=['count_vec_train', 'count_vec_test',
+                         'count_vec_names', 'count_vec'],
+                params={'n_features': 1000}, code=[text_features],
+                exclusive=True)
+def vectorize_text(df_train, df_test, n_features):
+    # Text Vecorizer #
+    print('Vectorize Text...')
+
+    # tfidf = TfidfVectorizer(
+    #         max_features=n_features,
+    #         norm='l2',
+    #         )
+
+    # Stem the corpus once, fit and transform all reuse it
+    stemmed_train = stem_texts(CombinedText(df_train), n_jobs=N_JOBS)
+    stemmed_test = stem_texts(CombinedText(df_test), n_jobs=N_JOBS)
+
+    count_vec = CountVectorizer(stop_words=None,
+                                lowercase=False,
+                                max_features=n_features,
+                                binary=True,
+                                ngram_range=(1, 2))
+
+    count_vec.fit(stemmed_train + stemmed_test)
+
+    # Keep the word counts sparse, they are stacked with the other features
+    # just before training
+    count_vec_train = count_vec.transform(stemmed_train).astype(np.float32)
+    count_vec_test = count_vec.transform(stemmed_test).astype(np.float32)
+    count_vec_names = ['count_vec_' + str(i)
+                       for i in range(count_vec_train.shape[1])]
+
+    return count_vec_train, count_vec_test, count_vec_names, count_vec
+
+
+feature_blocks = ['categorical', 'resources', 'timestamps', 'text_stats',
+                  'key_chars', 'sentiment']
+
+
+@pipeline.stage(inputs=['df_train', 'df_test', 'count_vec_train',
+                        'count_vec_test', 'count_vec_names'] +
+                [block + '_train' for block in feature_blocks] +
+                [block + '_test' for block in feature_blocks],
+                outputs=['X_train', 'y_train', 'X_test', 'id_test',
+                         'feature_names'],
+                cache=False, code=[feature_matrix])
+def build_matrices(df_train, df_test, count_vec_train, count_vec_test,
+                   count_vec_names, *blocks):
+    # Set up training and test sets: every block stacked into one CSR
+    # matrix, teacher_id left out
+    train_blocks = blocks[:len(feature_blocks)]
+    test_blocks = blocks[len(feature_blocks):]
+
+    def stack(df, frames, count_vec_block):
+        frame = pd.concat([df[NUMERIC_COLUMNS]] + list(frames), axis=1).\
+            drop(['teacher_id'], axis=1)
+        return hstack_features([frame_to_csr(frame),
+                                (count_vec_block, count_vec_names)])
+
+    X, feature_names = stack(df_train, train_blocks, count_vec_train)
+    X_test, _ = stack(df_test, test_blocks, count_vec_test)
+
+    y = df_train['project_is_approved'].values
+    id_test = df_test['id'].to_numpy(dtype=str)
+
+    return X, y, X_test, id_test, feature_names
+
+
+checkpoint = CheckpointStore(CHECKPOINT_PATH)
+
+if RESUME and checkpoint.has('X_train', 'y_train', 'X_test', 'id_test'):
+    # Pick up from the checkpoint, without rebuilding any features
+    print('Resuming from checkpoint...')
+    X, feature_names = checkpoint.load('X_train')
+    categorical_features = checkpoint.attributes('X_train')['categorical']
+    count_vec_terms = checkpoint.attributes('X_train')['count_vec_terms']
+    y, _ = checkpoint.load('y_train')
+    X_test, _ = checkpoint.load('X_test')
+    id_test, _ = checkpoint.load('id_test')
+else:
+    if STREAMING:
+        # One global pass for the vocabularies, then every row-local feature
+        # chunk by chunk
+        encoder, count_vec = fit_vocabularies(
+            [(DATA_PATH + 'train.csv', TRAIN_DTYPES),
+             (DATA_PATH + 'test.csv', TEST_DTYPES)], cols, n_jobs=N_JOBS)
+        encoder.save(DATA_PATH + 'categories.json')
+
+        resouces = aggregate_resources(DATA_PATH + 'resources.csv')
+
+        for name, dtypes in (('train', TRAIN_DTYPES), ('test', TEST_DTYPES)):
+            stream_featurize(DATA_PATH + name + '.csv', dtypes,
+                             STREAM_PATH + name + '/', encoder, count_vec,
+                             resources=resouces, n_jobs=N_JOBS)
+
+        del encoder, resouces
+        gc.collect()
+
+        X, feature_names, y, _ = load_streamed(STREAM_PATH + 'train/')
+        X_test, _, _, id_test = load_streamed(STREAM_PATH + 'test/')
+    else:
+        # Only the stages whose code, settings or data changed are run
+        results = pipeline.run('X_train', 'y_train', 'X_test', 'id_test',
+                               'feature_names', 'count_vec')
+
+        X = results['X_train']
+        y = results['y_train']
+        X_test = results['X_test']
+        id_test = results['id_test']
+        feature_names = results['feature_names']
+        count_vec = results['count_vec']
+
+        del results
+        gc.collect()
+
+    # Word of each count_vec column (columns are in alphabetical order)
+    count_vec_terms = sorted(count_vec.vocabulary_)
+
+    # Checkpoint the feature matrices: CSR npz / npy blocks plus a manifest
+    checkpoint.save('X_train', X, names=feature_names,
+                    categorical=categorical_features,
+                    count_vec_terms=count_vec_terms)
+    checkpoint.save('y_train', y)
+    checkpoint.save('X_test', X_test, names=feature_names)
+    checkpoint.save('id_test', id_test)
 
 print('Light GBM...')
-cnt = 0
-p_buf = []
 n_splits = 5
 n_repeats = 1
-model_dict = defaultdict()
 kf = RepeatedKFold(
     n_splits=n_splits,
     n_repeats=n_repeats,
     random_state=0)
-auc_buf = []
-
-for train_index, valid_index in kf.split(X):
-    print('Fold {}/{}'.format(cnt + 1, n_splits))
-    params = {
-        'boosting_type': 'gbdt',
-        'objective': 'binary',
-        'metric': 'auc',
-        'max_depth': 14,
-        'num_leaves': 31,
-        'learning_rate': 0.025,
-        'feature_fraction': 0.85,
-        'bagging_fraction': 0.85,
-        'bagging_freq': 5,
-        'verbose': 0,
-        'num_threads': 1,
-        'lambda_l2': 1.0,
-        'min_gain_to_split': 0,
-        'histogram_pool_size': 512
-    }
-
-    lgb_train = lgb.Dataset(
-        X.loc[train_index],
-        y.loc[train_index],
-        feature_name=feature_names,
-        )
-    lgb_train.raw_data = None
-
-    lgb_valid = lgb.Dataset(
-        X.loc[valid_index],
-        y.loc[valid_index],
-        )
-    lgb_valid.raw_data = None
-
-    model = lgb.train(
-        params,
-        lgb_train,
-        num_boost_round=10000,
-        valid_sets=[lgb_train, lgb_valid],
-        early_stopping_rounds=100,
-        verbose_eval=100,
-    )
-
-    if cnt == 0:
-        importance = model.feature_importance()
-        model_fnames = model.feature_name()
-        tuples = sorted(zip(model_fnames, importance),
-                        key=lambda x: x[1])[:: -1]
-        tuples = [x for x in tuples if x[1] > 0]
-        print('Important features:')
-        for i in range(60):
-            if i < len(tuples):
-                print(tuples[i])
-            else:
-                break
-
-        del importance, model_fnames, tuples
-
-    p = model.predict(X.loc[valid_index], num_iteration=model.best_iteration)
-    auc = roc_auc_score(y.loc[valid_index], p)
-
-    print('{} AUC: {}'.format(cnt, auc))
-
-    p = model.predict(X_test, num_iteration=model.best_iteration)
-    if len(p_buf) == 0:
-        p_buf = np.array(p, dtype=np.float16)
-    else:
-        p_buf += np.array(p, dtype=np.float16)
-    auc_buf.append(auc)
 
-    # Save individual models for comparison later
-    model_dict[cnt] = model
-
-    cnt += 1
-    # if cnt > 0: # Comment this to run several folds
-    #     break
-
-    del model, lgb_train, lgb_valid, p
-    gc.collect
+params = {
+    'boosting_type': 'gbdt',
+    'objective': 'binary',
+    'metric': 'auc',
+    'max_depth': 14,
+    'num_leaves': 31,
+    'learning_rate': 0.025,
+    'feature_fraction': 0.85,
+    'bagging_fraction': 0.85,
+    'bagging_freq': 5,
+    'verbose': 0,
+    'lambda_l2': 1.0,
+    'min_gain_to_split': 0,
+    'histogram_pool_size': 512
+}
+
+# Folds train side by side, sharing the cores between them
+oof_preds, preds, auc_buf, models = run_cv(
+    params, X, y, X_test, kf.split(X),
+    feature_names=feature_names,
+    categorical_features=categorical_features,
+    num_boost_round=10000,
+    early_stopping_rounds=100,
+    n_jobs=os.cpu_count())
+
+# Save individual models for comparison later
+model_dict = dict(enumerate(models))
+
+importance = model_dict[0].feature_importance()
+model_fnames = model_dict[0].feature_name()
+tuples = sorted(zip(model_fnames, importance),
+                key=lambda x: x[1])[:: -1]
+tuples = [x for x in tuples if x[1] > 0]
+print('Important features:')
+for i in range(60):
+    if i < len(tuples):
+        print(tuples[i])
+    else:
+        break
 
+del importance, model_fnames, tuples, models
+gc.collect()
 
 auc_mean = np.mean(auc_buf)
 auc_std = np.std(auc_buf)
 print('AUC = {:.6f} +/- {:.6f}'.format(auc_mean, auc_std))
 
-preds = p_buf/cnt
-
 subm = pd.DataFrame()
 subm['id'] = id_test
 subm['project_is_approved'] = preds
@@ -462,13 +378,9 @@ shap.initjs()
 explainer = shap.TreeExplainer(model_dict[0])
 shap_values = explainer.shap_values(X)
 
-fig = shap.summary_plot(shap_values, X)
+fig = shap.summary_plot(shap_values, X, feature_names=feature_names)
 
 gc.collect()
 
 # Print word from count_vec id
-i = 0
-for word, _ in sorted(count_vec.vocabulary_.items()):
-    if i == 821:
-        print(word)
-    i += 1
+print(count_vec_terms[821])
@@ -0,0 +1,39 @@
+'''
+Atomic file writes.
+
+A file is written to a temporary file next to its final path and moved over
+it with os.replace once complete, so a crash mid-write never leaves a
+truncated file behind: readers see either the old or the new version.
+
+    with atomic_write(path, 'wb') as f:
+        pickle.dump(result, f)
+
+    write_json(DATA_PATH + 'categories.json', vocabularies)
+'''
+
+import os
+import json
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_write(path, mode='w'):
+    '''
+    Open a temporary file to write path's new contents to. It replaces path
+    when the with block finishes, and is removed if the block fails.
+    '''
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_json(path, obj, **kwargs):
+    # json.dump obj to path atomically; kwargs go to json.dump
+    with atomic_write(path) as f:
+        json.dump(obj, f, **kwargs)
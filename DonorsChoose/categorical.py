@@ -0,0 +1,69 @@
+'''
+Categorical encoding shared by train, test and new applications.
+
+One vocabulary per column is built over all the frames at once with pandas'
+hash-based unique, so a value gets the same code everywhere. Columns are
+converted to the pandas category dtype, which LightGBM can use as native
+categorical features (see frame_to_csr), and the vocabularies are saved as
+json so new applications are scored with the same codes.
+
+    encoder = CategoricalEncoder(cols).fit(df_train, df_test)
+    df_train = encoder.transform(df_train)
+    encoder.save(DATA_PATH + 'categories.json')
+'''
+
+import json
+
+import numpy as np
+import pandas as pd
+
+from atomic import write_json
+
+
+class CategoricalEncoder:
+
+    def __init__(self, columns, vocabularies=None):
+        self.columns = list(columns)
+        self.vocabularies = vocabularies or {}
+
+    def fit(self, *frames):
+        '''
+        Vocabulary of every column over all frames, in order of first
+        appearance. Missing values are not a category.
+        '''
+        for column in self.columns:
+            values = pd.concat([df[column] for df in frames],
+                               ignore_index=True)
+            self.vocabularies[column] = list(values.dropna().unique())
+        return self
+
+    def dtype(self, column):
+        return pd.CategoricalDtype(self.vocabularies[column])
+
+    def transform(self, df):
+        '''
+        df with every column converted to the category dtype. Values not in
+        the vocabulary become missing.
+        '''
+        for column in self.columns:
+            df[column] = df[column].astype(self.dtype(column))
+        return df
+
+    def codes(self, df, dtype=np.int32):
+        '''
+        Integer codes of every column, -1 for missing or unseen values.
+        '''
+        return pd.DataFrame(
+            {column: pd.Categorical(df[column], dtype=self.dtype(column)).
+             codes.astype(dtype) for column in self.columns},
+            index=df.index)
+
+    def save(self, path):
+        write_json(path, {column: [str(v) for v in self.vocabularies[column]]
+                          for column in self.columns})
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            vocabularies = json.load(f)
+        return cls(vocabularies.keys(), vocabularies)
@@ -0,0 +1,96 @@
+'''
+Checkpoints of intermediate feature matrices.
+
+Replaces the text csv dumps of the preprocessed features. Each block is
+saved in a binary format that loads without parsing: dense arrays as .npy
+files, memory mapped when read back, and sparse matrices as CSR .npz files.
+manifest.json records the kind, shape, dtype and column names of every
+block, plus any extra attributes, so a later run (or another version of the
+script) can pick up from the saved matrices.
+
+    checkpoint = CheckpointStore(DATA_PATH + 'checkpoints/')
+    checkpoint.save('X_train', X, names=feature_names)
+    X, feature_names = checkpoint.load('X_train')
+'''
+
+import os
+import json
+
+import numpy as np
+import scipy.sparse as sp
+
+from atomic import atomic_write, write_json
+
+
+class CheckpointStore:
+
+    def __init__(self, path):
+        self.path = path
+        self._manifest_path = os.path.join(path, 'manifest.json')
+
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, 'r') as f:
+                self.manifest = json.load(f)
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.manifest = {}
+
+    def _save_manifest(self):
+        write_json(self._manifest_path, self.manifest, indent=1)
+
+    def __contains__(self, name):
+        return name in self.manifest
+
+    def has(self, *names):
+        return all(name in self for name in names)
+
+    def save(self, name, block, names=None, **attributes):
+        '''
+        Save a dense array or a scipy sparse matrix as block name, replacing
+        any block of that name. names are the column names; attributes are
+        stored in the manifest and must be json serialisable.
+        '''
+        if names is not None and len(names) != block.shape[-1]:
+            raise ValueError('Need one name per column')
+
+        if sp.issparse(block):
+            kind = 'sparse'
+            filename = name + '.npz'
+            with atomic_write(os.path.join(self.path, filename), 'wb') as f:
+                sp.save_npz(f, sp.csr_matrix(block), compressed=False)
+        else:
+            kind = 'dense'
+            filename = name + '.npy'
+            block = np.asarray(block)
+            if block.dtype == object:
+                block = block.astype(str)
+            with atomic_write(os.path.join(self.path, filename), 'wb') as f:
+                np.save(f, block)
+
+        self.manifest[name] = {
+            'kind': kind,
+            'file': filename,
+            'shape': list(block.shape),
+            'dtype': block.dtype.str,
+            'names': None if names is None else list(names),
+            'attributes': attributes,
+            }
+        self._save_manifest()
+
+    def load(self, name, mmap=True):
+        '''
+        Block name and its column names. Dense blocks are memory mapped
+        read-only unless mmap is False.
+        '''
+        entry = self.manifest[name]
+        path = os.path.join(self.path, entry['file'])
+
+        if entry['kind'] == 'sparse':
+            block = sp.load_npz(path).tocsr()
+        else:
+            block = np.load(path, mmap_mode='r' if mmap else None)
+
+        return block, entry['names']
+
+    def attributes(self, name):
+        return self.manifest[name]['attributes']
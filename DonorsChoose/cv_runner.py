@@ -0,0 +1,144 @@
+'''
+Cross validation of LightGBM models with folds trained in parallel.
+
+The features are binned once into a single lgb.Dataset, and every fold
+trains on subset()s of it instead of re-binning its rows. Folds run on a
+thread pool (LightGBM releases the GIL while training), each with
+threads_per_fold LightGBM threads, and write their out-of-fold and test
+predictions into preallocated float32 buffers.
+
+    oof, test_preds, scores, models = run_cv(params, X, y, X_test,
+                                             kf.split(X), feature_names)
+'''
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import lightgbm as lgb
+from sklearn.metrics import roc_auc_score
+
+# Characters LightGBM refuses in feature names, and what replaces them
+_NAME_REPLACEMENTS = {'"': 'quote', ',': 'comma', ':': 'colon',
+                      '[': 'lbracket', ']': 'rbracket',
+                      '{': 'lbrace', '}': 'rbrace'}
+
+
+def lightgbm_feature_names(names):
+    '''
+    Feature names with the characters LightGBM rejects (JSON specials) spelt
+    out, e.g. n_: becomes n_colon.
+    '''
+    clean = []
+    for name in names:
+        for char, word in _NAME_REPLACEMENTS.items():
+            name = name.replace(char, word)
+        clean.append(name)
+
+    if len(set(clean)) != len(clean):
+        raise ValueError('Feature names clash once cleaned up')
+    return clean
+
+
+def _train_fold(params, train_set, valid_set, X, y, X_test, fold,
+                valid_index, num_boost_round, early_stopping_rounds,
+                verbose_eval, oof, test_preds):
+    callbacks = [lgb.early_stopping(early_stopping_rounds, verbose=False)]
+    if verbose_eval:
+        callbacks.append(lgb.log_evaluation(verbose_eval))
+
+    model = lgb.train(params, train_set, num_boost_round=num_boost_round,
+                      valid_sets=[train_set, valid_set],
+                      callbacks=callbacks)
+
+    oof[fold, valid_index] = model.predict(
+        X[valid_index], num_iteration=model.best_iteration)
+    score = roc_auc_score(y[valid_index], oof[fold, valid_index])
+
+    if X_test is not None:
+        test_preds[fold] = model.predict(X_test,
+                                         num_iteration=model.best_iteration)
+
+    print('Fold {} AUC: {:.6f} ({} rounds)'.format(fold, score,
+                                                   model.best_iteration))
+
+    return model, score
+
+
+def run_cv(params, X, y, X_test, folds, feature_names=None,
+           categorical_features=None, num_boost_round=10000,
+           early_stopping_rounds=100, threads_per_fold=None, n_jobs=None,
+           verbose_eval=100):
+    '''
+    Train one model per (train_index, valid_index) fold.
+
+    categorical_features names the columns of X (codes, missing values
+    negative or NaN) LightGBM should split on as categories. Names are
+    passed through lightgbm_feature_names, so the models use those.
+
+    n_jobs cores (all by default) are split between folds trained at the
+    same time, each using threads_per_fold LightGBM threads (by default
+    enough to spread the cores over all folds).
+
+    Returns the out-of-fold predictions (averaged over repeats, NaN for rows
+    never used for validation), the test predictions averaged over folds,
+    the validation AUC of each fold and the models.
+    '''
+    folds = [(np.asarray(train_index), np.asarray(valid_index))
+             for train_index, valid_index in folds]
+    y = np.asarray(y)
+
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if threads_per_fold is None:
+        threads_per_fold = max(1, n_jobs // len(folds))
+    n_parallel = max(1, min(len(folds), n_jobs // threads_per_fold))
+
+    params = dict(params, num_threads=threads_per_fold)
+
+    if feature_names is not None:
+        renamed = dict(zip(feature_names,
+                           lightgbm_feature_names(feature_names)))
+        feature_names = [renamed[name] for name in feature_names]
+        if categorical_features is not None:
+            categorical_features = [renamed[name]
+                                    for name in categorical_features]
+
+    # Bin the features once; every fold trains on subsets of this Dataset
+    full = lgb.Dataset(X, y, feature_name=feature_names or 'auto',
+                       categorical_feature=categorical_features or 'auto',
+                       free_raw_data=False,
+                       params={k: v for k, v in params.items()
+                               if k in ('max_bin', 'min_data_in_bin',
+                                        'verbose', 'num_threads')})
+    full.construct()
+
+    # Fold subsets are built up front, one thread at a time
+    fold_sets = [(full.subset(train_index, params=params).construct(),
+                  full.subset(valid_index, params=params).construct())
+                 for train_index, valid_index in folds]
+
+    oof = np.full((len(folds), len(y)), np.nan, dtype=np.float32)
+    n_test = 0 if X_test is None else X_test.shape[0]
+    test_preds = np.zeros((len(folds), n_test), dtype=np.float32)
+
+    print('Training {} folds, {} at a time with {} threads each'.format(
+        len(folds), n_parallel, threads_per_fold))
+
+    with ThreadPoolExecutor(max_workers=n_parallel) as executor:
+        futures = [executor.submit(_train_fold, params, train_set, valid_set,
+                                   X, y, X_test, fold, valid_index,
+                                   num_boost_round, early_stopping_rounds,
+                                   verbose_eval if n_parallel == 1 else 0,
+                                   oof, test_preds)
+                   for fold, ((train_set, valid_set), (_, valid_index))
+                   in enumerate(zip(fold_sets, folds))]
+        results = [future.result() for future in futures]
+
+    models = [model for model, _ in results]
+    scores = [score for _, score in results]
+
+    # Mean over repeats of each row's out-of-fold predictions
+    with np.errstate(invalid='ignore', divide='ignore'):
+        oof = np.nansum(oof, axis=0) / (~np.isnan(oof)).sum(axis=0)
+
+    return oof.astype(np.float32), test_preds.mean(axis=0), scores, models
@@ -0,0 +1,72 @@
+'''
+Calendar features of the project submission timestamps.
+
+The timestamp column is parsed once into datetime64, and every feature is
+derived from it with vectorised accessors into compact dtypes: the calendar
+fields, the epoch, cyclic encodings of month, weekday and time of day, and
+the number of days to the nearest US federal holidays.
+'''
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.holiday import USFederalHolidayCalendar
+
+# Format of project_submitted_datetime, e.g. 2016-12-05 13:43:57
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _cyclic(values, period):
+    angle = (2 * np.pi / period) * np.asarray(values, dtype=np.float32)
+    return np.sin(angle).astype(np.float32), np.cos(angle).astype(np.float32)
+
+
+def holiday_distances(dates):
+    '''
+    Days since the previous and until the next US federal holiday (0 on a
+    holiday) of every date, as int16 arrays.
+    '''
+    days = dates.values.astype('datetime64[D]')
+
+    # Holidays a year either side, so every date has one before and after
+    holidays = USFederalHolidayCalendar().holidays(
+        start=dates.min() - pd.Timedelta(days=366),
+        end=dates.max() + pd.Timedelta(days=366)).values.astype(
+            'datetime64[D]')
+
+    after = np.searchsorted(holidays, days, side='left')
+    before = np.searchsorted(holidays, days, side='right') - 1
+
+    days_to = (holidays[after] - days).astype(np.int16)
+    days_since = (days - holidays[before]).astype(np.int16)
+
+    return days_since, days_to
+
+
+def datetime_features(timestamps):
+    '''
+    DataFrame of calendar features of a column of timestamp strings, with
+    the same index. 'epoch' is the timestamp in nanoseconds.
+    '''
+    dates = pd.to_datetime(timestamps, format=TIMESTAMP_FORMAT)
+    accessor = dates.dt
+
+    features = pd.DataFrame({
+        'year': accessor.year.astype(np.uint16),
+        'month': accessor.month.astype(np.uint8),
+        'day_of_week': accessor.weekday.astype(np.uint8),
+        'hour': accessor.hour.astype(np.uint8),
+        'minute': accessor.minute.astype(np.uint8),
+        'epoch': dates.values.astype('datetime64[ns]').astype(np.int64),
+        }, index=timestamps.index)
+
+    features['month_sin'], features['month_cos'] = \
+        _cyclic(features['month'].values - 1, 12)
+    features['day_of_week_sin'], features['day_of_week_cos'] = \
+        _cyclic(features['day_of_week'].values, 7)
+    features['time_of_day_sin'], features['time_of_day_cos'] = \
+        _cyclic(features['hour'].values + features['minute'].values / 60, 24)
+
+    features['days_since_holiday'], features['days_to_holiday'] = \
+        holiday_distances(dates)
+
+    return features
@@ -0,0 +1,162 @@
+'''
+Content-addressed cache of per-text features.
+
+Every text is keyed by a hash of its contents, so features are only computed
+for text the cache has not seen before: re-runs are free, and a new daily
+batch of applications only pays for its new essays.
+
+Each extractor gets its own folder per version, so bumping an extractor's
+version starts a fresh cache instead of mixing old and new features. The
+folder is columnar: one raw binary file per feature column, plus the keys
+and a small meta.json, all appended to in place.
+
+    cache = FeatureCache(CACHE_PATH, 'key_chars', version=1)
+    counts, names = cache.compute(texts, count_key_characters)
+'''
+
+import os
+import json
+import hashlib
+from itertools import islice
+
+import numpy as np
+
+from atomic import write_json
+
+# Bytes of blake2b digest per text
+KEY_SIZE = 16
+
+# Texts hashed and computed at a time
+COMPUTE_CHUNK_SIZE = 100000
+
+
+def text_keys(texts):
+    # Hash of every text, as bytes
+    return [hashlib.blake2b(str(text).encode('utf-8'),
+                            digest_size=KEY_SIZE).digest()
+            for text in texts]
+
+
+class FeatureCache:
+
+    def __init__(self, cache_dir, extractor, version):
+        self.extractor = extractor
+        self.version = version
+        self.path = os.path.join(cache_dir,
+                                 '{}_v{}'.format(extractor, version))
+
+        self._meta_path = os.path.join(self.path, 'meta.json')
+        self._keys_path = os.path.join(self.path, 'keys.dat')
+
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, 'r') as f:
+                self.meta = json.load(f)
+        else:
+            os.makedirs(self.path, exist_ok=True)
+            self.meta = {'extractor': extractor, 'version': version,
+                         'n_rows': 0, 'names': None, 'dtype': None}
+
+        # Row of every cached key. Files can hold a partly written batch
+        # past n_rows, which is ignored and overwritten on the next append
+        keys = b''
+        if self.n_rows:
+            with open(self._keys_path, 'rb') as f:
+                keys = f.read(self.n_rows * KEY_SIZE)
+        self._rows = {keys[i:i + KEY_SIZE]: i // KEY_SIZE
+                      for i in range(0, len(keys), KEY_SIZE)}
+
+    @property
+    def n_rows(self):
+        return self.meta['n_rows']
+
+    @property
+    def names(self):
+        return self.meta['names']
+
+    def _column_path(self, j):
+        return os.path.join(self.path, 'col_{:03d}.dat'.format(j))
+
+    def _save_meta(self):
+        write_json(self._meta_path, self.meta)
+
+    def column(self, j):
+        '''
+        Cached values of feature column j, memory mapped read-only.
+        '''
+        dtype = np.dtype(self.meta['dtype'])
+        if self.n_rows == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self._column_path(j), dtype=dtype, mode='r',
+                         shape=(self.n_rows,))
+
+    def _append(self, keys, block, names):
+        if self.names is None:
+            self.meta['names'] = list(names)
+            self.meta['dtype'] = block.dtype.str
+        elif list(names) != self.names or \
+                block.dtype != np.dtype(self.meta['dtype']):
+            raise ValueError('{} returned different columns than the cache '
+                             'holds; bump its version'.format(self.extractor))
+
+        # Drop anything past n_rows left by an interrupted append
+        with open(self._keys_path, 'ab') as f:
+            f.truncate(self.n_rows * KEY_SIZE)
+            f.write(b''.join(keys))
+
+        for j in range(block.shape[1]):
+            with open(self._column_path(j), 'ab') as f:
+                f.truncate(self.n_rows * block.dtype.itemsize)
+                f.write(np.ascontiguousarray(block[:, j]).tobytes())
+
+        for i, key in enumerate(keys):
+            self._rows[key] = self.n_rows + i
+
+        self.meta['n_rows'] += len(keys)
+        self._save_meta()
+
+    def _compute_chunk(self, texts, function):
+        # Rows of a chunk of texts, computing and appending the new ones
+        keys = text_keys(texts)
+
+        # First position of every text not cached yet
+        new = {}
+        for i, key in enumerate(keys):
+            if key not in self._rows and key not in new:
+                new[key] = i
+
+        if new:
+            print('{}: computing features of {} new texts'.format(
+                self.extractor, len(new)))
+            block, names = function([texts[i] for i in new.values()])
+            self._append(list(new.keys()), np.asarray(block), names)
+
+        return np.array([self._rows[key] for key in keys], dtype=np.int64)
+
+    def compute(self, texts, function, chunk_size=COMPUTE_CHUNK_SIZE):
+        '''
+        Features of every text, computing only those not cached yet.
+
+        function(texts) must return an (n_texts, n_features) block and its
+        column names, like count_key_characters. Texts are hashed and
+        computed chunk_size at a time, so only one chunk of them is held
+        in memory. Returns the block for all texts, in order, and the
+        column names.
+        '''
+        if hasattr(texts, '__getitem__'):
+            chunks = (texts[i:i + chunk_size]
+                      for i in range(0, len(texts), chunk_size))
+        else:
+            texts = iter(texts)
+            chunks = iter(lambda: list(islice(texts, chunk_size)), [])
+
+        rows = [self._compute_chunk(list(chunk), function)
+                for chunk in chunks]
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+
+        dtype = np.dtype(self.meta['dtype']) if self.names else np.float32
+        features = np.empty((len(rows), len(self.names or [])), dtype=dtype)
+
+        for j in range(features.shape[1]):
+            features[:, j] = self.column(j)[rows]
+
+        return features, list(self.names or [])
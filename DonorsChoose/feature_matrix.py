@@ -0,0 +1,49 @@
+'''
+Sparse feature matrices for LightGBM.
+
+The bag-of-words features are mostly zeros, so they stay in CSR form from the
+vectorizer all the way into lgb.Dataset. The numeric features are converted
+to CSR too and stacked alongside, with the feature names carried in the same
+order as the columns.
+'''
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+def frame_to_dense(df, dtype=np.float32):
+    # Numeric DataFrame as a 2D array. Category columns become their codes,
+    # for LightGBM's categorical_feature, and missing categories NaN
+    dense = np.empty(df.shape, dtype=dtype)
+    for j, (name, column) in enumerate(df.items()):
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            codes = column.cat.codes.to_numpy()
+            dense[:, j] = np.where(codes < 0, np.nan, codes)
+        else:
+            dense[:, j] = column.to_numpy(dtype=dtype, na_value=np.nan)
+    return dense
+
+
+def frame_to_csr(df, dtype=np.float32):
+    # Numeric DataFrame as (CSR matrix, column names). NaNs are stored
+    # explicitly, and LightGBM reads them as missing values
+    return sp.csr_matrix(frame_to_dense(df, dtype)), list(df.columns)
+
+
+def hstack_features(blocks, dtype=np.float32):
+    '''
+    Stack (matrix, names) blocks side by side into one CSR matrix.
+
+    Blocks can be dense arrays or scipy sparse matrices. Returns the matrix
+    and the names of all its columns.
+    '''
+    matrices = []
+    names = []
+    for matrix, block_names in blocks:
+        if matrix.shape[1] != len(block_names):
+            raise ValueError('Need one name per column')
+        matrices.append(sp.csr_matrix(matrix, dtype=dtype))
+        names.extend(block_names)
+
+    return sp.hstack(matrices, format='csr', dtype=dtype), names
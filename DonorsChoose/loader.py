@@ -0,0 +1,105 @@
+'''
+Typed loading of the DonorsChoose csv files, with a columnar cache.
+
+Every column is read with an explicit, compact dtype, and text as
+Arrow-backed strings rather than Python objects, optionally chunk by chunk.
+The first load of each file is saved as Parquet next to the data, and later
+runs read that instead of parsing the csv again. The cache is rebuilt
+whenever the csv is newer.
+
+Without pyarrow, text columns fall back to the default string dtype and
+nothing is cached.
+
+    df_train = load_table(DATA_PATH + 'train.csv', TRAIN_DTYPES,
+                          cache_dir=DATA_PATH + 'cache/')
+'''
+
+import os
+
+import pandas as pd
+
+from atomic import atomic_write
+
+try:
+    import pyarrow  # noqa: F401
+    STRING_DTYPE = 'string[pyarrow]'
+except ImportError:
+    pyarrow = None
+    STRING_DTYPE = 'string'
+
+# Data types of test.csv; train.csv adds the label
+TEST_DTYPES = {
+    'id': STRING_DTYPE,
+    'project_id': STRING_DTYPE,
+    'project_title': STRING_DTYPE,
+    'project_grade_category': STRING_DTYPE,
+    'project_subject_categories': STRING_DTYPE,
+    'school_state': STRING_DTYPE,
+    'project_subject_subcategories': STRING_DTYPE,
+    'project_resource_summary': STRING_DTYPE,
+    'project_essay_1': STRING_DTYPE,
+    'project_essay_2': STRING_DTYPE,
+    'project_essay_3': STRING_DTYPE,
+    'project_essay_4': STRING_DTYPE,
+    'project_submitted_datetime': STRING_DTYPE,
+    'teacher_id': STRING_DTYPE,
+    'teacher_prefix': STRING_DTYPE,
+    'teacher_number_of_previously_posted_projects': 'uint32',
+    }
+
+TRAIN_DTYPES = dict(TEST_DTYPES, project_is_approved='uint8')
+
+
+def cached_frame(cache_path, sources, build):
+    '''
+    Read the DataFrame saved at cache_path (a Parquet file) if it is newer
+    than every source file, otherwise build() it and save it there.
+    '''
+    if pyarrow is not None and os.path.exists(cache_path):
+        cache_time = os.path.getmtime(cache_path)
+        if all(os.path.getmtime(source) < cache_time for source in sources):
+            return pd.read_parquet(cache_path)
+
+    df = build()
+
+    if pyarrow is not None:
+        os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+        with atomic_write(cache_path, 'wb') as f:
+            df.to_parquet(f, index=False)
+
+    return df
+
+
+def read_csv_typed(path, dtypes, usecols=None, chunk_size=None):
+    '''
+    Read a csv with the given dtypes. With chunk_size the file is parsed
+    that many rows at a time, which keeps the parser's peak memory down.
+    '''
+    if usecols is not None:
+        dtypes = {k: v for k, v in dtypes.items() if k in usecols}
+
+    if chunk_size is None:
+        return pd.read_csv(path, dtype=dtypes, usecols=usecols)
+
+    chunks = pd.read_csv(path, dtype=dtypes, usecols=usecols,
+                         chunksize=chunk_size)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def load_table(path, dtypes, cache_dir=None, usecols=None, chunk_size=None):
+    '''
+    Load a csv with read_csv_typed, through a Parquet cache in cache_dir
+    (if given).
+    '''
+    def build():
+        return read_csv_typed(path, dtypes, usecols, chunk_size)
+
+    if cache_dir is None:
+        return build()
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    if usecols is not None:
+        name += '_' + '_'.join(sorted(usecols))
+
+    return cached_frame(os.path.join(cache_dir, name + '.parquet'), [path],
+                        build)
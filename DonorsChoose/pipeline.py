@@ -0,0 +1,241 @@
+'''
+A small stage graph for the DonorsChoose preprocessing.
+
+Each stage is a function declaring the named inputs it takes (outputs of
+other stages) and the named outputs it returns. Results are cached by
+fingerprint: a hash of the stage's name, version, source code (and that of
+the helper modules it calls), parameters and source file stamps, plus the
+fingerprints of the stages it reads from.
+A change to one stage therefore only re-runs that stage and the stages
+downstream of it; everything else is loaded from the cache. Stages whose
+inputs are ready run side by side on a thread pool (the heavy stages hand
+their work to process pools or release the GIL). Stages that start their
+own process pools are marked exclusive: they run one at a time on the main
+thread, once no other stage is running, so their workers are never forked
+from a worker thread or beside busy threads.
+
+    pipeline = Pipeline(DATA_PATH + 'stages/')
+
+    @pipeline.stage(inputs=['df_train'], outputs=['timestamps_train'],
+                    code=[datetime_features])
+    def process_timestamp(df_train):
+        ...
+
+    results = pipeline.run('timestamps_train')
+'''
+
+import os
+import time
+import pickle
+import hashlib
+import inspect
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from atomic import atomic_write
+
+
+class Stage:
+
+    def __init__(self, name, function, inputs, outputs, version=1,
+                 params=None, sources=(), cache=True, code=(),
+                 exclusive=False):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.version = version
+        self.params = params or {}
+        self.sources = list(sources)
+        self.cache = cache
+        self.code = list(code)
+        self.exclusive = exclusive
+
+    def source_code(self):
+        # The stage function and the modules / functions listed in code
+        sources = []
+        for obj in [self.function] + self.code:
+            try:
+                sources.append(inspect.getsource(obj))
+            except (OSError, TypeError):
+                sources.append(getattr(obj, '__qualname__', obj.__name__))
+        return sources
+
+
+class Pipeline:
+
+    def __init__(self, cache_dir, max_workers=None):
+        '''
+        max_workers stages run at once (default: as many as are ready).
+        '''
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.stages = {}
+        self._producers = {}
+
+    def add(self, function, inputs=(), outputs=None, name=None, version=1,
+            params=None, sources=(), cache=True, code=(), exclusive=False):
+        '''
+        Add function as a stage. It is called with the values of inputs,
+        in order, as keyword arguments params, and returns one value per
+        output (a tuple if there are several). sources are files read by
+        the stage; it is re-run when they change. code are the modules (or
+        functions) doing the stage's work; it is re-run when their source
+        changes. Stages with cache=False run every time they are needed,
+        and stages with exclusive=True (those starting process pools) run
+        on the main thread while no other stage is running.
+        '''
+        name = name or function.__name__
+        outputs = list(outputs or [name])
+
+        if name in self.stages:
+            raise ValueError('Stage {} is already defined'.format(name))
+        for output in outputs:
+            if output in self._producers:
+                raise ValueError('{} is already an output of {}'.format(
+                    output, self._producers[output]))
+
+        self.stages[name] = Stage(name, function, inputs, outputs, version,
+                                  params, sources, cache, code, exclusive)
+        for output in outputs:
+            self._producers[output] = name
+
+        return function
+
+    def stage(self, **kwargs):
+        # Decorator form of add()
+        def decorator(function):
+            return self.add(function, **kwargs)
+        return decorator
+
+    def _producer(self, output):
+        if output not in self._producers:
+            raise KeyError('No stage outputs {}'.format(output))
+        return self.stages[self._producers[output]]
+
+    def fingerprint(self, name, _memo=None):
+        _memo = {} if _memo is None else _memo
+        if name in _memo:
+            return _memo[name]
+
+        stage = self.stages[name]
+        digest = hashlib.sha256()
+        digest.update(repr((stage.name, stage.version, stage.source_code(),
+                            sorted(stage.params.items()),
+                            stage.outputs)).encode('utf-8'))
+
+        for source in stage.sources:
+            stat = os.stat(source)
+            digest.update(repr((source, stat.st_mtime, stat.st_size)).
+                          encode('utf-8'))
+
+        for output in stage.inputs:
+            digest.update(self.fingerprint(self._producer(output).name,
+                                           _memo).encode('utf-8'))
+
+        _memo[name] = digest.hexdigest()[:16]
+        return _memo[name]
+
+    def _cache_path(self, name, fingerprint):
+        return os.path.join(self.cache_dir, name, fingerprint + '.pkl')
+
+    def _load(self, path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def _save(self, name, path, result):
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+
+        with atomic_write(path, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # Only the latest result of each stage is kept
+        for filename in os.listdir(folder):
+            if os.path.join(folder, filename) != path and \
+                    filename.endswith('.pkl'):
+                os.remove(os.path.join(folder, filename))
+
+    def _call(self, stage, values):
+        start = time.time()
+        result = stage.function(*[values[i] for i in stage.inputs],
+                                **stage.params)
+        if len(stage.outputs) == 1:
+            result = (result,)
+        elif len(result) != len(stage.outputs):
+            raise ValueError('Stage {} returned {} values for {} outputs'.
+                             format(stage.name, len(result),
+                                    len(stage.outputs)))
+        print('Stage {} done in {:.1f}s'.format(stage.name,
+                                                time.time() - start))
+        return result
+
+    def run(self, *targets):
+        '''
+        Values of the target outputs, as a dict. Only stages whose results
+        are not cached, and which are needed for the targets, are run.
+        '''
+        memo = {}
+
+        # Stages to load from the cache and stages to run, working back
+        # from the targets
+        load, execute = {}, {}
+        pending = [self._producer(target).name for target in targets]
+        while pending:
+            name = pending.pop()
+            if name in load or name in execute:
+                continue
+            stage = self.stages[name]
+            path = self._cache_path(name, self.fingerprint(name, memo))
+            if stage.cache and os.path.exists(path):
+                load[name] = path
+            else:
+                execute[name] = path
+                pending.extend(self._producer(i).name for i in stage.inputs)
+
+        values = {}
+
+        def store(stage, result):
+            values.update(zip(stage.outputs, result))
+
+        for name, path in load.items():
+            print('Stage {} loaded from cache'.format(name))
+            store(self.stages[name], self._load(path))
+
+        def run_stage(name):
+            stage = self.stages[name]
+            result = self._call(stage, values)
+            if stage.cache:
+                self._save(name, execute[name], result)
+            return result
+
+        remaining = dict(execute)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers or
+                                max(1, len(execute))) as executor:
+            while remaining or running:
+                ready = [name for name in remaining
+                         if all(i in values for i in
+                                self.stages[name].inputs)]
+                for name in ready:
+                    if not self.stages[name].exclusive:
+                        del remaining[name]
+                        running[executor.submit(run_stage, name)] = name
+
+                if not running:
+                    # The thread pool is idle: run one exclusive stage here
+                    exclusive = [name for name in ready
+                                 if self.stages[name].exclusive]
+                    if not exclusive:
+                        raise RuntimeError('Stages {} can never run'.format(
+                            sorted(remaining)))
+                    name = exclusive[0]
+                    del remaining[name]
+                    store(self.stages[name], run_stage(name))
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    store(self.stages[name], future.result())
+
+        return {target: values[target] for target in targets}
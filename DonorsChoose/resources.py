@@ -0,0 +1,189 @@
+'''
+Per-application aggregates of resources.csv.
+
+resources.csv is read in chunks. Each chunk is reduced to partial sums,
+squared sums, minima, maxima and counts per id with sorted segment
+reductions (ufunc.reduceat), and the partials of all chunks are reduced the
+same way at the end, so the full file never sits in memory and no Python
+function runs per group. Distinct values for 'nunique' are kept as
+(id, value) pairs, de-duplicated chunk by chunk. Missing values are skipped,
+as pandas' groupby skips them.
+
+New aggregates only need an entry in the aggregates dict, and new per-row
+values, such as description text stats, an entry in derived:
+
+    derived = {'description_len': ('description', lambda s: s.str.len())}
+    aggregates = dict(RESOURCE_AGGREGATES,
+                      description_len=['sum', 'mean', 'max'])
+    resources = aggregate_resources(path, aggregates, derived)
+'''
+
+import numpy as np
+import pandas as pd
+
+from loader import STRING_DTYPE
+
+RESOURCE_DTYPES = {
+    'id': STRING_DTYPE,
+    'description': STRING_DTYPE,
+    'quantity': 'uint32',
+    'price': 'float32'
+    }
+
+# Statistics of each column, named '<column>_<stat>' in the output
+RESOURCE_AGGREGATES = {
+    'quantity': ['sum', 'min', 'max', 'mean', 'std'],
+    'price': ['count', 'sum', 'min', 'max', 'mean', 'std', 'nunique'],
+    }
+
+STATS = ('count', 'sum', 'min', 'max', 'mean', 'std', 'nunique')
+
+# Partial statistics kept per id, and how partials of two chunks combine
+_PARTIALS = {'count': np.add, 'sum': np.add, 'sumsq': np.add,
+             'min': np.fmin, 'max': np.fmax}
+
+
+def reduce_by_key(keys, columns):
+    '''
+    Reduce every (array, ufunc) in columns over the rows sharing a key.
+
+    Returns the distinct keys and a dict of reduced arrays, one value per
+    key, in the same order.
+    '''
+    codes, uniques = pd.factorize(np.asarray(keys))
+    if len(codes) == 0:
+        return uniques, {name: array[:0] for name, (array, _) in
+                         columns.items()}
+
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+
+    reduced = {name: ufunc.reduceat(np.asarray(array)[order], starts)
+               for name, (array, ufunc) in columns.items()}
+
+    return uniques[codes[starts]], reduced
+
+
+def _chunk_partials(ids, values):
+    # NaN only counts towards min / max (which fmin / fmax skip), so an id
+    # whose values are all missing gets a count and sum of 0
+    values = np.asarray(values, dtype=np.float64)
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0)
+    return reduce_by_key(ids, {
+        'count': (present.astype(np.int64), np.add),
+        'sum': (filled, np.add),
+        'sumsq': (filled * filled, np.add),
+        'min': (values, np.fmin),
+        'max': (values, np.fmax)})
+
+
+def _finish(partials, stats):
+    # Statistics from combined partials; std uses ddof=1 like pandas
+    count = partials['count']
+    features = {}
+    for stat in stats:
+        if stat == 'count':
+            features[stat] = count.astype(np.uint32)
+        elif stat in ('sum', 'min', 'max'):
+            features[stat] = partials[stat].astype(np.float32)
+        elif stat == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = partials['sum'] / count
+            features[stat] = mean.astype(np.float32)
+        elif stat == 'std':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                var = (partials['sumsq'] - partials['sum'] ** 2 / count) / \
+                    (count - 1)
+            features[stat] = np.sqrt(np.maximum(var, 0)).astype(np.float32)
+    return features
+
+
+def aggregate_resources(path, aggregates=RESOURCE_AGGREGATES, derived=None,
+                        chunk_size=500000):
+    '''
+    DataFrame with one row per id of resources.csv and a '<column>_<stat>'
+    column per requested statistic, plus mean_price.
+
+    derived maps new column names to (source column, function) pairs; the
+    function gets each chunk of the source column and returns the values to
+    aggregate.
+    '''
+    derived = derived or {}
+    for column, stats in aggregates.items():
+        unknown = set(stats) - set(STATS)
+        if unknown:
+            raise ValueError('Unknown statistics for {}: {}'.format(
+                column, sorted(unknown)))
+
+    usecols = {'id'}
+    for column in aggregates:
+        usecols.add(derived[column][0] if column in derived else column)
+
+    partials = {column: [] for column in aggregates}
+    pairs = {column: [] for column, stats in aggregates.items()
+             if 'nunique' in stats}
+
+    reader = pd.read_csv(path, usecols=sorted(usecols), dtype=RESOURCE_DTYPES,
+                         chunksize=chunk_size)
+
+    for chunk in reader:
+        ids = chunk['id'].to_numpy(dtype=object)
+
+        for column in aggregates:
+            if column in derived:
+                source, function = derived[column]
+                values = function(chunk[source])
+            else:
+                values = chunk[column]
+            # Missing values, pd.NA included, become NaN
+            values = pd.Series(values).to_numpy(dtype=np.float64,
+                                                na_value=np.nan)
+
+            partials[column].append(_chunk_partials(ids, values))
+
+            if column in pairs:
+                pairs[column].append(pd.DataFrame(
+                    {'id': ids, 'value': values}).dropna().
+                    drop_duplicates())
+
+    # Combine the partials of every chunk, aligned on the ids of the first
+    # column
+    resources = None
+    for column, stats in aggregates.items():
+        keys = np.concatenate([k for k, _ in partials[column]]) \
+            if partials[column] else np.array([], dtype=object)
+        combined = {name: (np.concatenate([p[name] for _, p in
+                                           partials[column]])
+                           if partials[column] else np.array([]), ufunc)
+                    for name, ufunc in _PARTIALS.items()}
+        ids, reduced = reduce_by_key(keys, combined)
+
+        if resources is None:
+            resources = pd.DataFrame({'id': ids})
+            index = pd.Index(ids)
+        rows = index.get_indexer(ids)
+
+        features = _finish(reduced, stats)
+        if column in pairs:
+            distinct = pd.concat(pairs[column]).drop_duplicates()
+            distinct_ids, counts = np.unique(
+                index.get_indexer(distinct['id'].to_numpy(dtype=object)),
+                return_counts=True)
+            features['nunique'] = np.zeros(len(index), dtype=np.uint32)
+            features['nunique'][distinct_ids] = counts
+
+        for stat in stats:
+            values = features[stat]
+            if stat != 'nunique':
+                aligned = np.empty(len(index), dtype=values.dtype)
+                aligned[rows] = values
+                values = aligned
+            resources['{}_{}'.format(column, stat)] = values
+
+    if 'price_sum' in resources and 'quantity_sum' in resources:
+        resources['mean_price'] = resources['price_sum'] / \
+            resources['quantity_sum']
+
+    return resources
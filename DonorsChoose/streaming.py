@@ -0,0 +1,272 @@
+'''
+Out-of-core featurization of DonorsChoose applications.
+
+Timestamps, text stats, key character counts and sentiment only look at one
+application at a time, so they are computed for one chunk of rows at a
+time and written straight to disk; memory use depends on the chunk size, not
+on the number of applications. The only global pass is fit_vocabularies,
+which streams the files once to collect the categorical vocabularies and
+the document frequencies of the stemmed terms.
+
+    encoder, count_vec = fit_vocabularies(
+        [(DATA_PATH + 'train.csv', TRAIN_DTYPES),
+         (DATA_PATH + 'test.csv', TEST_DTYPES)], cols)
+    stream_featurize(DATA_PATH + 'train.csv', TRAIN_DTYPES,
+                     DATA_PATH + 'streamed/train/', encoder, count_vec)
+    X, names, labels, ids = load_streamed(DATA_PATH + 'streamed/train/')
+
+The row-block functions are shared with the in-memory pipeline of
+DonorsChoose.py, so both modes produce the same features.
+'''
+
+import os
+import json
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer
+
+from atomic import write_json
+from categorical import CategoricalEncoder
+from datetime_features import datetime_features
+from feature_matrix import frame_to_dense
+from text_features import count_key_characters, extract_sentiment, \
+    stem_texts, text_statistics, CombinedText
+
+# Applications per chunk
+STREAM_CHUNK_SIZE = 100000
+
+# Numeric columns used as they are
+NUMERIC_COLUMNS = ['teacher_number_of_previously_posted_projects']
+
+
+# Row-local feature blocks, one DataFrame per chunk of applications
+
+def timestamp_block(df):
+    # Calendar, cyclic and holiday features; the timestamp itself becomes
+    # its epoch in nanoseconds
+    features = datetime_features(df['project_submitted_datetime'])
+    features.insert(0, 'project_submitted_datetime', features.pop('epoch'))
+    return features
+
+
+def text_stats_block(df):
+    # Length, word count and sentence count of each text field
+    stats, names = text_statistics(df)
+    return pd.DataFrame(stats, columns=names, index=df.index)
+
+
+def _cached(cache, texts, function):
+    if cache is None:
+        return function(texts)
+    return cache.compute(texts, function)
+
+
+def key_chars_block(df, cache=None, n_jobs=None):
+    # Count all 27 key characters in one pass per essay, as a uint16 block
+    counts, names = _cached(
+        cache, CombinedText(df),
+        lambda texts: count_key_characters(texts, n_jobs=n_jobs,
+                                           dtype=np.uint16))
+    return pd.DataFrame(counts, columns=names, index=df.index)
+
+
+def sentiment_block(df, cache=None, n_jobs=None):
+    # TextBlob polarity / subjectivity and VADER scores, as a float32 block
+    sentiment, names = _cached(
+        cache, CombinedText(df),
+        lambda texts: extract_sentiment(texts, n_jobs=n_jobs))
+    return pd.DataFrame(sentiment, columns=names, index=df.index)
+
+
+def read_chunks(path, dtypes, chunk_size=STREAM_CHUNK_SIZE):
+    # Typed chunks of a csv file
+    return pd.read_csv(path, dtype=dtypes, chunksize=chunk_size)
+
+
+def fit_vocabularies(sources, categorical_columns, n_features=1000,
+                     chunk_size=STREAM_CHUNK_SIZE, max_terms=None,
+                     n_jobs=None):
+    '''
+    The global pass: categorical vocabularies and the n_features terms
+    (stemmed unigrams and bigrams) found in the most documents, over every
+    (path, dtypes) source.
+
+    To keep memory bounded, only the max_terms (default 200 * n_features)
+    most frequent terms are kept between chunks, so for very rare terms the
+    document frequencies are approximate. Returns a CategoricalEncoder and a
+    CountVectorizer with a fixed vocabulary, ready to transform chunks.
+    '''
+    max_terms = max_terms or 200 * n_features
+    vocabularies = {column: {} for column in categorical_columns}
+    doc_freq = Counter()
+
+    for path, dtypes in sources:
+        for chunk in read_chunks(path, dtypes, chunk_size):
+            for column in categorical_columns:
+                vocabularies[column].update(
+                    dict.fromkeys(chunk[column].dropna().unique()))
+
+            # Documents containing each term in this chunk
+            counter = CountVectorizer(lowercase=False, binary=True,
+                                      ngram_range=(1, 2))
+            counts = counter.fit_transform(
+                stem_texts(CombinedText(chunk), n_jobs=n_jobs))
+            doc_freq.update(dict(zip(counter.get_feature_names_out(),
+                                     np.asarray(counts.sum(axis=0))[0].
+                                     tolist())))
+
+            if len(doc_freq) > max_terms:
+                doc_freq = Counter(dict(doc_freq.most_common(max_terms)))
+
+    encoder = CategoricalEncoder(
+        categorical_columns,
+        {column: list(values) for column, values in vocabularies.items()})
+
+    # Columns in alphabetical order, as a fitted CountVectorizer has them
+    terms = sorted(term for term, _ in doc_freq.most_common(n_features))
+    count_vec = CountVectorizer(lowercase=False, binary=True,
+                                ngram_range=(1, 2), vocabulary=terms)
+
+    return encoder, count_vec
+
+
+def featurize_chunk(df, encoder, count_vec, resources=None,
+                    feature_caches=None, n_jobs=None, drop=('teacher_id',)):
+    '''
+    Dense features (a DataFrame) and word counts (a CSR matrix) of one chunk
+    of applications. resources is the output of aggregate_resources indexed
+    by id. feature_caches can map 'key_chars' / 'sentiment' to
+    FeatureCaches. Columns in drop are left out of the features.
+    '''
+    feature_caches = feature_caches or {}
+
+    blocks = [df[NUMERIC_COLUMNS],
+              encoder.transform(df[encoder.columns].copy())]
+    if resources is not None:
+        blocks.append(resources.reindex(df['id'].to_numpy(dtype=object)).
+                      set_index(df.index))
+    blocks += [timestamp_block(df),
+               text_stats_block(df),
+               key_chars_block(df, feature_caches.get('key_chars'), n_jobs),
+               sentiment_block(df, feature_caches.get('sentiment'), n_jobs)]
+
+    dense = pd.concat(blocks, axis=1).drop(list(drop), axis=1,
+                                           errors='ignore')
+
+    count_vec_block = count_vec.transform(
+        stem_texts(CombinedText(df), n_jobs=n_jobs)).astype(np.float32)
+
+    return dense, count_vec_block
+
+
+class ChunkWriter:
+    '''
+    Appends featurized chunks to a folder: dense features as one float32
+    row-major file, word counts as one CSR npz per chunk, and the ids and
+    labels, with a meta.json written after every chunk.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.meta = {'n_rows': 0, 'n_chunks': 0, 'dense_names': None,
+                     'count_vec_names': None, 'has_labels': None}
+        for filename in ('dense.dat', 'labels.dat', 'ids.txt'):
+            open(os.path.join(path, filename), 'wb').close()
+
+    def _save_meta(self):
+        write_json(os.path.join(self.path, 'meta.json'), self.meta)
+
+    def append(self, dense, count_vec_block, ids, labels=None):
+        names = list(dense.columns)
+        if self.meta['dense_names'] is None:
+            self.meta['dense_names'] = names
+            self.meta['count_vec_names'] = [
+                'count_vec_' + str(i)
+                for i in range(count_vec_block.shape[1])]
+            self.meta['has_labels'] = labels is not None
+        elif names != self.meta['dense_names']:
+            raise ValueError('Chunk has different columns')
+
+        with open(os.path.join(self.path, 'dense.dat'), 'ab') as f:
+            f.write(frame_to_dense(dense).tobytes())
+
+        sp.save_npz(os.path.join(self.path, 'count_vec_{:05d}.npz'.format(
+            self.meta['n_chunks'])), count_vec_block.tocsr(),
+            compressed=False)
+
+        with open(os.path.join(self.path, 'ids.txt'), 'a') as f:
+            f.write(''.join(str(i) + '\n' for i in ids))
+
+        if labels is not None:
+            with open(os.path.join(self.path, 'labels.dat'), 'ab') as f:
+                f.write(np.asarray(labels, dtype=np.uint8).tobytes())
+
+        self.meta['n_rows'] += len(ids)
+        self.meta['n_chunks'] += 1
+        self._save_meta()
+
+
+def stream_featurize(path, dtypes, out_dir, encoder, count_vec,
+                     resources=None, feature_caches=None,
+                     chunk_size=STREAM_CHUNK_SIZE, n_jobs=None,
+                     label_column='project_is_approved'):
+    '''
+    Featurize a csv chunk by chunk into out_dir. resources is the output of
+    aggregate_resources. Returns the number of rows.
+    '''
+    writer = ChunkWriter(out_dir)
+
+    if resources is not None and 'id' in resources.columns:
+        resources = resources.set_index('id')
+
+    for i, chunk in enumerate(read_chunks(path, dtypes, chunk_size)):
+        print('Featurizing chunk {} ({} rows)'.format(i, len(chunk)))
+        dense, count_vec_block = featurize_chunk(
+            chunk, encoder, count_vec, resources, feature_caches, n_jobs)
+
+        labels = chunk[label_column].to_numpy() \
+            if label_column in chunk else None
+        writer.append(dense, count_vec_block, chunk['id'].to_numpy(), labels)
+
+    return writer.meta['n_rows']
+
+
+def load_streamed(out_dir, mmap=True):
+    '''
+    The features written by stream_featurize: a CSR matrix of the dense and
+    word count columns, the column names, the labels (None for test) and
+    the ids.
+    '''
+    with open(os.path.join(out_dir, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+
+    n_rows = meta['n_rows']
+    dense_names = meta['dense_names'] or []
+    dense = np.memmap(os.path.join(out_dir, 'dense.dat'), dtype=np.float32,
+                      mode='r', shape=(n_rows, len(dense_names))) \
+        if n_rows else np.zeros((0, len(dense_names)), dtype=np.float32)
+    if not mmap:
+        dense = np.array(dense)
+
+    count_vec = sp.vstack([
+        sp.load_npz(os.path.join(out_dir, 'count_vec_{:05d}.npz'.format(i)))
+        for i in range(meta['n_chunks'])], format='csr') \
+        if meta['n_chunks'] else sp.csr_matrix((0, 0), dtype=np.float32)
+
+    X = sp.hstack([sp.csr_matrix(dense), count_vec], format='csr',
+                  dtype=np.float32)
+    names = dense_names + (meta['count_vec_names'] or [])
+
+    labels = None
+    if meta['has_labels']:
+        labels = np.fromfile(os.path.join(out_dir, 'labels.dat'),
+                             dtype=np.uint8)
+
+    with open(os.path.join(out_dir, 'ids.txt'), 'r') as f:
+        ids = np.array(f.read().splitlines())
+
+    return X, names, labels, ids
@@ -0,0 +1,293 @@
+# Text features for the DonorsChoose applications
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# Key characters counted in every application. The names match the columns
+# count_characters used to create with one regex per character ('n_' + name)
+KEY_CHARS = ['!', '\\?', '@', '#', '\\$', '%', '&', '\\*', '\\(', '\\[',
+             '\\{', '\\|', '-', '_', '=', '\\+', '\\.', ':', ';', ',', '/',
+             '\\\\r', '\\\\t', '\\"', '\\.\\.\\.', 'etc', 'http']
+
+# The literal text each of those regexes matches
+KEY_TOKENS = ['!', '?', '@', '#', '$', '%', '&', '*', '(', '[',
+              '{', '|', '-', '_', '=', '+', '.', ':', ';', ',', '/',
+              '\\r', '\\t', '"', '...', 'etc', 'http']
+
+# Sentiment columns: TextBlob polarity and subjectivity, then the VADER scores
+SENTIMENT_NAMES = ['text_polarity_TB', 'text_subj_TB', 'tp_vader_compond',
+                   'tp_vader_neg', 'tp_vader_neu', 'tp_vader_pos']
+
+# Text columns described by text_statistics
+TEXT_COLUMNS = ['project_title', 'project_essay_1', 'project_essay_2',
+                'project_essay_3', 'project_essay_4',
+                'project_resource_summary']
+
+# Text columns joined, in this order, into each application's text
+COMBINED_COLUMNS = ['project_title', 'project_resource_summary',
+                    'project_essay_1', 'project_essay_2', 'project_essay_3',
+                    'project_essay_4']
+
+# Bump when an extractor's output changes, so cached features are recomputed
+KEY_CHARS_VERSION = 1
+SENTIMENT_VERSION = 1
+
+# Rows of text per chunk sent to a worker process
+CHUNK_SIZE = 2000
+
+# Distinct words whose stems are remembered by each (worker) process
+STEM_CACHE_SIZE = 2 ** 18
+
+# VADER analyzer and Porter stemmer of this (worker) process, built on first
+# use
+_vader_analyzer = None
+_stemmer = None
+
+_non_word = re.compile(r'\W')
+
+
+def _count_chunk(texts, tokens=KEY_TOKENS):
+    # Lowercase each text once. Single characters are counted for the whole
+    # chunk in one pass over the utf-8 bytes (ascii bytes never appear inside
+    # a multi-byte character); longer tokens use str.count, which counts
+    # non-overlapping matches just like re.findall did
+    lowered = [str(text).lower() for text in texts]
+    counts = np.zeros((len(lowered), len(tokens)), dtype=np.uint32)
+
+    single = [(j, token) for j, token in enumerate(tokens) if len(token) == 1]
+    multi = [(j, token) for j, token in enumerate(tokens) if len(token) > 1]
+
+    if single and lowered:
+        encoded = [text.encode('utf-8') for text in lowered]
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64,
+                              count=len(encoded))
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        doc = np.repeat(np.arange(len(encoded), dtype=np.int64), lengths)
+
+        lookup = np.full(256, -1, dtype=np.int64)
+        for j, token in single:
+            lookup[ord(token)] = j
+        column = lookup[data]
+        keep = column >= 0
+
+        counts += np.bincount(doc[keep] * len(tokens) + column[keep],
+                              minlength=len(lowered) * len(tokens)).\
+            reshape(len(lowered), len(tokens)).astype(np.uint32)
+
+    for j, token in multi:
+        counts[:, j] = [text.count(token) for text in lowered]
+
+    return counts
+
+
+def _map_chunks(function, texts, n_jobs=None, chunk_size=CHUNK_SIZE,
+                max_in_flight=None):
+    # Apply function to chunks of rows on n_jobs processes (all cores by
+    # default, 1 to stay in this process) and stack the resulting blocks.
+    # Chunks are sliced as they are submitted, and at most max_in_flight
+    # (default 2 per process) are queued at a time, so a CombinedText view
+    # only builds a few chunks of strings at a time in this process
+    if not hasattr(texts, '__getitem__'):
+        texts = list(texts)
+    starts = range(0, len(texts), chunk_size)
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    if max_in_flight is None:
+        max_in_flight = 2 * n_jobs
+
+    if n_jobs == 1 or len(starts) <= 1:
+        return [function(texts[i:i + chunk_size]) for i in starts]
+
+    blocks = [None] * len(starts)
+    chunks = iter(enumerate(starts))
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        in_flight = {}
+
+        while True:
+            # Top up the pool, keeping the number of queued chunks bounded
+            while len(in_flight) < max_in_flight:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                j, i = chunk
+                future = executor.submit(function, texts[i:i + chunk_size])
+                in_flight[future] = j
+
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                blocks[in_flight.pop(future)] = future.result()
+
+    return blocks
+
+
+def _join_columns(columns):
+    # Join text Series with single spaces; missing values become 'nan',
+    # as str(x) made them
+    text = columns[0].astype('string').fillna('nan')
+    others = [column.astype('string').fillna('nan') for column in columns[1:]]
+    return text.str.cat(others, sep=' ').to_numpy(dtype=object)
+
+
+def combine_text(df, columns=COMBINED_COLUMNS):
+    '''
+    The text columns of df joined by spaces into one string per row.
+    '''
+    return pd.Series(_join_columns([df[column] for column in columns]),
+                     index=df.index)
+
+
+class CombinedText:
+    '''
+    Lazy view of the combined text of every row of a DataFrame.
+
+    Holds on to the text columns (dropping them from the DataFrame later is
+    fine) and only joins the rows that are sliced or iterated over, so the
+    full combined text is never stored as an object column. Slices return
+    arrays of strings.
+    '''
+
+    def __init__(self, df, columns=COMBINED_COLUMNS):
+        self.columns = [df[column] for column in columns]
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return _join_columns([column.iloc[key]
+                                  for column in self.columns])
+        key = range(len(self))[key]
+        return self[key:key + 1][0]
+
+    def __iter__(self):
+        for i in range(0, len(self), CHUNK_SIZE):
+            yield from self[i:i + CHUNK_SIZE]
+
+
+def count_key_characters(texts, n_jobs=None, chunk_size=CHUNK_SIZE,
+                         dtype=np.uint32):
+    '''
+    Count every key character in each text.
+
+    Returns an (n_texts, len(KEY_CHARS)) count matrix and its column names.
+    Chunks of rows are counted in parallel on n_jobs processes (all cores by
+    default, 1 to count in this process).
+    '''
+    blocks = _map_chunks(_count_chunk, texts, n_jobs, chunk_size)
+
+    if blocks:
+        counts = np.concatenate(blocks)
+    else:
+        counts = np.zeros((0, len(KEY_TOKENS)), dtype=np.uint32)
+
+    names = ['n_' + c for c in KEY_CHARS]
+
+    return counts.astype(dtype, copy=False), names
+
+
+def text_statistics(df, columns=TEXT_COLUMNS):
+    '''
+    Length, word count and sentence count of every text column, as an
+    (n_rows, 3 * len(columns)) uint32 block, and its column names.
+
+    Missing texts count as the string 'nan', and words are separated by
+    single spaces, as in the original len(str(x).split(' ')).
+    '''
+    stats = np.empty((len(df), 3 * len(columns)), dtype=np.uint32)
+    names = []
+
+    for j, column in enumerate(columns):
+        text = df[column].astype('string').fillna('nan').str
+
+        stats[:, 3 * j] = text.len().to_numpy()
+        stats[:, 3 * j + 1] = text.count(' ').to_numpy() + 1
+        stats[:, 3 * j + 2] = text.count(r'[.!?]+').to_numpy()
+
+        names += [column + '_len', column + '_wc', column + '_sc']
+
+    return stats, names
+
+
+def _get_vader_analyzer():
+    global _vader_analyzer
+    if _vader_analyzer is None:
+        from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+        _vader_analyzer = SentimentIntensityAnalyzer()
+    return _vader_analyzer
+
+
+def _sentiment_chunk(texts):
+    from textblob import TextBlob
+
+    analyzer = _get_vader_analyzer()
+    sentiment = np.zeros((len(texts), len(SENTIMENT_NAMES)), dtype=np.float32)
+
+    for i, text in enumerate(texts):
+        text = str(text)
+
+        # One TextBlob parse gives both polarity and subjectivity
+        blob_sentiment = TextBlob(text).sentiment
+        sentiment[i, 0] = round(blob_sentiment.polarity, 2)
+        sentiment[i, 1] = round(blob_sentiment.subjectivity, 2)
+
+        scores = analyzer.polarity_scores(text)
+        sentiment[i, 2:] = [scores['compound'], scores['neg'],
+                            scores['neu'], scores['pos']]
+
+    return sentiment
+
+
+def extract_sentiment(texts, n_jobs=None, chunk_size=500):
+    '''
+    TextBlob polarity and subjectivity and the four VADER scores of each
+    text, as an (n_texts, 6) float32 block, and its column names.
+
+    Each worker process builds one VADER analyzer and reuses it for every
+    text it is sent.
+    '''
+    blocks = _map_chunks(_sentiment_chunk, texts, n_jobs, chunk_size)
+
+    if blocks:
+        sentiment = np.concatenate(blocks)
+    else:
+        sentiment = np.zeros((0, len(SENTIMENT_NAMES)), dtype=np.float32)
+
+    return sentiment, list(SENTIMENT_NAMES)
+
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem_word(word):
+    global _stemmer
+    if _stemmer is None:
+        from nltk.stem import PorterStemmer
+        _stemmer = PorterStemmer()
+    return _stemmer.stem(word)
+
+
+def _stem_chunk(texts):
+    return [' '.join([stem_word(word.lower())
+                      for word in _non_word.split(str(text)) if word])
+            for text in texts]
+
+
+def stem_texts(texts, n_jobs=None, chunk_size=CHUNK_SIZE):
+    '''
+    Lowercase, tokenise on non-word characters and Porter stem every text.
+
+    Returns the stemmed texts, with words joined by single spaces, ready for
+    a CountVectorizer without a preprocessor. Stems come from a bounded LRU
+    cache, so each distinct word is stemmed about once per worker.
+    '''
+    return [text for chunk in _map_chunks(_stem_chunk, texts, n_jobs,
+                                          chunk_size)
+            for text in chunk]
@@ -1,10 +1,8 @@
 # Final, cleaned-up version before the competition ends!
 
 import os
-from glob import glob
 import pandas as pd
 import numpy as np
-import cv2
 import matplotlib.pyplot as plt
 import seaborn as sns
 
@@ -20,11 +18,18 @@ https://github.com/datarobot/pic2vec/tree/master/pic2vec
 # ImageFeaturizer slightly modified to read through multiple directories
 from pic2vec.image_featurizer_multiclass import ImageFeaturizerMulti
 
-'''
-ImageFilter created for Seedlings Classification Competition
-https://github.com/dheinicke1/auto-adjust-filter/tree/master/auto-adjust-filter
-'''
-from image_filter import ImageFilter
+# On-disk, memory-mapped store of featurized images
+from pic2vec.feature_store import FeatureStore
+
+# Vectorised ensembling of model probabilities
+from ensemble import combine_predictions, search_weights, fit_stacker,\
+    stack_predictions
+
+# Kaggle submission writer
+from submission import write_submission
+
+# Parallel, resumable HSV masking pass over the image folders
+from image_masking import mask_folder
 
 # Folders to save images
 TRAIN_DATA_FOLDER = '.../Seedlings/train'
@@ -32,6 +37,9 @@ TEST_DATA_FOLDER = '.../Seedlings/test'
 MASK_DATA_FOLDER = '.../Seedlings/train_mask'
 MASK_TEST_DATA_FOLDER = '.../Seedlings/test_mask'
 
+# Folder to save featurized images
+FEATURE_FOLDER = '.../Seedlings/features'
+
 #############################################################################
 
 # Definitions
@@ -41,19 +49,7 @@ MASK_TEST_DATA_FOLDER = '.../Seedlings/test_mask'
 
 def kaggle_preds(preds, image_labels, csv_filename):
 
-    kaggle_predictions = pd.DataFrame()
-
-    for pred, filename in zip(preds, image_labels):
-        plant = [key for key, value in label_to_id_dict.items()
-                 if value == pred]
-        plant = plant[0]
-        kaggle_predictions = kaggle_predictions.append({'file': filename,
-                                                        'species': plant},
-                                                       ignore_index=True)
-
-    kaggle_predictions = kaggle_predictions.sort_values(by='file')
-
-    kaggle_predictions.to_csv(csv_filename, index=False)
+    write_submission(preds, image_labels, label_to_id_dict, csv_filename)
 
 
 def plot_conf_matrix(preds, y_test, classes):
@@ -72,16 +68,22 @@ def plot_conf_matrix(preds, y_test, classes):
 
 def ensenble_predictions(proba_1, proba_2, weight_1):
 
-    combined_proba = np.add(proba_1 * weight_1, proba_2 * (1 - weight_1))
+    return combine_predictions([proba_1, proba_2], [weight_1, 1 - weight_1])
 
-    combined_preds = []
 
-    for array in combined_proba:
-        combined_preds.append(np.argmax(array))
+def print_weight_search(probas, y_true, n_steps=19, print_all=True):
+    # Score every weight vector in one batched pass over the grid
+    weights, scores, best_weights, best_score =\
+        search_weights(probas, y_true, n_steps=n_steps)
 
-    combined_preds = np.array(combined_preds)
+    if print_all:
+        for weight, score in zip(weights, scores):
+            print('Weight: %s \t Score: %f' % (np.round(weight, 3), score))
 
-    return(combined_preds)
+    print('Best weight: %s \t Score: %f' % (np.round(best_weights, 3),
+                                            best_score))
+
+    return best_weights
 
 #############################################################################
 
@@ -89,139 +91,78 @@ def ensenble_predictions(proba_1, proba_2, weight_1):
 
 #############################################################################
 
-# Use ImageFilter to mask training images
-
-
-for class_folder_name in os.listdir(TRAIN_DATA_FOLDER):
-    class_folder_path = TRAIN_DATA_FOLDER + '/' + class_folder_name
-
-    # See progress
-    print(class_folder_name)
-
-    for image_path in glob(os.path.join(class_folder_path, '*.png')):
-
-        # Starting point for finding green plants
-        upper_HSV_init = [48, 255, 255]
-        lower_HSV_init = [24, 27, 15]
-
-        # Read in the image in color
-        image = cv2.imread(image_path, cv2.IMREAD_COLOR)
-
-        # Apply the adjustable filter to mask the image
-        image_filter = ImageFilter(image=image, upper_HSV=upper_HSV_init,
-                                   lower_HSV=lower_HSV_init)
-        image_filter.min_shape_size = 150
-
-        processed_image, contours, upper_HSV, lower_HSV =\
-            image_filter.find_shapes()
-
-        # Save the masked image to a masked image folder
-        save_path = MASK_DATA_FOLDER + '/' + class_folder_name + '/' +\
-                                       os.path.basename(image_path) + '.png'
-
-        cv2.imwrite(save_path, processed_image)
-
-# Load and mask Test Images
-for image_path in glob(os.path.join(TEST_DATA_FOLDER, '*.png')):
-
-    # Starting point for finding green plants
-    upper_HSV_init = [48, 255, 255]
-    lower_HSV_init = [24, 27, 15]
-
-    # Read in the image in color
-    image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+# Mask training and test images across all cores.
+# Images already masked on a previous run are skipped.
+# Spawned workers (Windows) re-run this script, so mask in this process there.
 
-    image_filter = ImageFilter(image=image, upper_HSV=upper_HSV_init,
-                               lower_HSV=lower_HSV_init)
+N_WORKERS = os.cpu_count() if os.name != 'nt' else 1
 
-    image_filter.min_shape_size = 150
+failed = mask_folder(TRAIN_DATA_FOLDER, MASK_DATA_FOLDER, class_folders=True,
+                     n_workers=N_WORKERS)
+failed += mask_folder(TEST_DATA_FOLDER, MASK_TEST_DATA_FOLDER,
+                      class_folders=False, n_workers=N_WORKERS)
 
-    processed_image, contours, upper_HSV, lower_HSV =\
-        image_filter.find_shapes()
+# Every image needs a mask to line up the masked and original features, so
+# stop here (a re-run retries only the failed images)
+if failed:
+    raise RuntimeError('{} images could not be masked: {}'.format(
+        len(failed), failed))
 
-    # Save the masked image to a masked image folder
-    save_path = MASK_TEST_DATA_FOLDER + '/' + os.path.basename(image_path)\
-                                            + '.png'
-    cv2.imwrite(save_path, processed_image)
-
-# Featurize the masked training images
-# Change folder to original images folder to featurize the original images
+# Featurize the masked and original images into feature stores: one row per
+# image keyed by filename, kept on disk as a memory-mapped float32 matrix.
+# Images already in a store are skipped, so new images can be added later.
 
 # Type of pre-trained model to pass to ImageFeaturizerMulti
 model = 'xception'
+depth = 2
 
-train_images = []
-
-for class_folder_name in os.listdir(MASK_DATA_FOLDER):
-    class_folder_path = MASK_DATA_FOLDER + '/' + class_folder_name
-    print(class_folder_name)
-
-    featurizer = ImageFeaturizerMulti(depth=2, model=model)
-
-    featurizer.load_data(class_folder_name, image_path=class_folder_path)
-
-    train_images.append(featurizer.featurize())
-
-train_images = np.array(train_images)
+# One featurizer for every folder: the Xception model is only built once
+featurizer = ImageFeaturizerMulti(depth=depth, model=model)
 
-# np.save('featurized_xception_2_layer_train_mask.npy', train_images)
+for variant, train_folder, test_folder in [
+        ('mask', MASK_DATA_FOLDER, MASK_TEST_DATA_FOLDER),
+        ('original', TRAIN_DATA_FOLDER, TEST_DATA_FOLDER)]:
 
-# Get training labels
-labels = []
+    train_store = FeatureStore(FEATURE_FOLDER + '/train_' + variant,
+                               model=model, depth=depth, variant=variant,
+                               n_features=featurizer.num_features)
 
-for class_folder_name in os.listdir(TRAIN_DATA_FOLDER):
-    class_folder_path = MASK_DATA_FOLDER + '/' + class_folder_name
-    for image in glob(os.path.join(class_folder_path, '*.png')):
-        labels.append(class_folder_name)
+    for class_folder_name in os.listdir(train_folder):
+        print(variant, class_folder_name)
+        featurizer.featurize_to_store(train_store,
+                                      train_folder + '/' + class_folder_name,
+                                      label=class_folder_name)
 
-labels = np.array(labels)
+    test_store = FeatureStore(FEATURE_FOLDER + '/test_' + variant,
+                              model=model, depth=depth, variant=variant,
+                              n_features=featurizer.num_features)
 
-# Featurize the maksed test images
+    featurizer.featurize_to_store(test_store, test_folder)
 
-test_images = []
-
-featurizer = ImageFeaturizerMulti(depth=2, model=model)
-featurizer.load_data('test images', image_path=MASK_TEST_DATA_FOLDER)
-test_images_mask = (featurizer.featurize())
+###############################################################################
+# Load featurized images from the feature stores. The features are memory
+# mapped, so this doesn't need to re-featurize or parse anything.
 
-test_images_mask = np.array(test_images_mask)
-# np.save('featurized_xception_2_layer_test_mask.npy', test_images)
+train_store_mask = FeatureStore(FEATURE_FOLDER + '/train_mask')
+train_store_original = FeatureStore(FEATURE_FOLDER + '/train_original')
+test_store_mask = FeatureStore(FEATURE_FOLDER + '/test_mask')
+test_store_original = FeatureStore(FEATURE_FOLDER + '/test_original')
 
-###############################################################################
-# Alternatively, load previously featurized images as array
-# Featurized train images
-train_images_original = np.load('featurized_xception_2_layer_train_raw.npy')
-train_images_mask = np.load('featurized_xception_2_layer_train_mask_raw.npy')
+# Featurized train images. Masked images are saved as <filename>.png, so
+# strip the extra extension to line up the original image features.
+train_images_mask = np.asarray(train_store_mask.features)
+train_images_original = train_store_original.get(
+    [os.path.splitext(f)[0] for f in train_store_mask.filenames])
 
 # Training labels
-labels = np.load('labels_original.npy')
-
-# Featurized test images
-test_images_original = np.load('featurized_xception_2_layer_test.npy')
-test_images_mask = np.load('featurized_xception_2_layer_test_mask.npy')
+labels = train_store_mask.labels
 
 # Array of test set image filenames, for final submission
-test_filenames = np.load('test_filenames.npy')
+test_filenames = test_store_original.filenames
 
-# Process masked training images array to 2D
-
-X_mask = []
-
-for i in range(train_images_mask.shape[0]):
-    for j in range(train_images_mask[i].shape[0]):
-        X_mask.append(train_images_mask[i][j])
-
-train_images_mask = np.array(X_mask)
-
-# Process original training images array to 2D
-
-X_ = []
-
-for i in range(train_images_original.shape[0]):
-    for j in range(train_images_original[i].shape[0]):
-        X_.append(train_images_original[i][j])
-
-train_images_original = np.array(X_)
+# Featurized test images
+test_images_original = np.asarray(test_store_original.features)
+test_images_mask = test_store_mask.get([f + '.png' for f in test_filenames])
 
 # Create a dictionary of labels as numeric values, create target y
 
@@ -289,17 +230,10 @@ print(accuracy_score(combined_preds, y_test))
 
 plot_conf_matrix(combined_preds, y_test, unique_labels)
 
-# Optimize mask weight
-
-weights = np.linspace(0, 1.0, 20)  # ~0.57
+# Optimize mask weight (~0.57)
 
-for weight in weights:
-    combined_pred = ensenble_predictions(mask_preds_logreg_proba,
-                                         original_preds_logreg_proba,
-                                         weight)
-
-    score = accuracy_score(combined_pred, y_test)
-    print('Weight: %f \t Score: %f' % (weight, score))
+print_weight_search([mask_preds_logreg_proba,
+                     original_preds_logreg_proba], y_test)
 
 # Test #
 
@@ -432,45 +366,43 @@ kaggle_preds(mask_keras_preds, test_filenames, 'Keras_mask_preds.csv')
 
 #############################################################################
 
-# Optimize masked weight - Neural Net & XGBoost
-
-weights = np.linspace(0, 1.0, 20)  # ~0.42, 88.7%
+# Optimize masked weight - Neural Net & XGBoost (~0.42, 88.7%)
 
-for weight in weights:
-    combined_pred = ensenble_predictions(mask_preds_xgb_proba,
-                                         mask_preds_keras_proba, weight)
-    score = accuracy_score(combined_pred, y_test_mask)
-    print('Weight: %f \t Score: %f' % (weight, score))
+print_weight_search([mask_preds_xgb_proba,
+                     mask_preds_keras_proba], y_test_mask)
 
-# Optimize original weight - Neural Net & XGBoost
+# Optimize original weight - Neural Net & XGBoost (~0.36, 90.4%)
 
-weights = np.linspace(0, 1.0, 20)  # ~0.36, 90.4%
+print_weight_search([original_preds_xgb_proba,
+                     original_preds_keras_proba], y_test)
 
-for weight in weights:
-    combined_pred = ensenble_predictions(original_preds_xgb_proba,
-                                         original_preds_keras_proba, weight)
-    score = accuracy_score(combined_pred, y_test)
-    print('Weight: %f \t Score: %f' % (weight, score))
+# Optimize masked weight - Neural Net & LogisticRegression (1, 0.63, 91.6%)
 
-# Optimize masked weight - Neural Net & LogisticRegression
+print_weight_search([mask_preds_logreg_proba,
+                     mask_preds_keras_proba], y_test_mask)
 
-weights = np.linspace(0, 1.0, 20)  # 1, 0.63, 91.6%
+# Optimize original weight - Neural Net & LogisticRegression (~0.58, 91%)
 
-for weight in weights:
-    combined_pred = ensenble_predictions(mask_preds_logreg_proba,
-                                         mask_preds_keras_proba, weight)
-    score = accuracy_score(combined_pred, y_test_mask)
-    print('Weight: %f \t Score: %f' % (weight, score))
+print_weight_search([original_preds_logreg_proba,
+                     original_preds_keras_proba], y_test)
 
-# Optimize original weight - Neural Net & LogisticRegression
+# Optimize masked weights of all three models at once
+print_weight_search([mask_preds_logreg_proba,
+                     mask_preds_keras_proba,
+                     mask_preds_xgb_proba], y_test_mask, n_steps=40,
+                    print_all=False)
 
-weights = np.linspace(0, 1.0, 20)  # ~0.58, 91%
+# Alternatively, stack the models with a meta-learner. Fit it on one half of
+# the holdout set and score it on the other half.
+stack_probas = [mask_preds_logreg_proba, mask_preds_keras_proba,
+                mask_preds_xgb_proba]
+half = len(y_test_mask) // 2
 
-for weight in weights:
-    combined_pred = ensenble_predictions(original_preds_logreg_proba,
-                                         original_preds_keras_proba, weight)
-    score = accuracy_score(combined_pred, y_test)
-    print('Weight: %f \t Score: %f' % (weight, score))
+stacker = fit_stacker([proba[:half] for proba in stack_probas],
+                      y_test_mask[:half])
+stacked_preds = stack_predictions(stacker,
+                                  [proba[half:] for proba in stack_probas])
+print(accuracy_score(stacked_preds, y_test_mask[half:]))
 
 # Logreg & Keras Ensenble Preditions #
 #############################################################################
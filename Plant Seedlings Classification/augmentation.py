@@ -0,0 +1,215 @@
+'''
+CPU data pipeline for training the Seedlings CNNs without a GPU.
+
+Instead of decoding every image into one big in-memory array and augmenting
+it with Keras' ImageDataGenerator, ImageBatchGenerator keeps only the image
+paths. A pool of worker processes decodes the PNGs for each batch, resizes
+them, optionally applies an HSV mask, and applies random rotations and
+flips with OpenCV / NumPy. Finished batches wait in a bounded queue, so the
+training loop always has the next batches ready without holding the whole
+dataset in memory. Pass an ImageCache to skip decoding altogether.
+
+    train_generator = ImageBatchGenerator(train_paths, y_train,
+                                          batch_size=64, image_size=299,
+                                          preprocessing_function=preprocess_input)
+
+    model.fit_generator(train_generator,
+                        steps_per_epoch=len(train_generator),
+                        epochs=epochs, workers=1, use_multiprocessing=False)
+
+    train_generator.close()
+'''
+
+import os
+from collections import deque
+from multiprocessing import Pool
+
+import numpy as np
+import cv2
+
+
+def load_image(image_path, image_size, mask_HSV=None):
+    # Decode and resize a single image, optionally keeping only the pixels
+    # inside the (lower, upper) HSV thresholds
+    image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    image = cv2.resize(image, (image_size, image_size))
+
+    if mask_HSV is not None:
+        lower_HSV, upper_HSV = mask_HSV
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        mask = cv2.inRange(hsv, np.array(lower_HSV), np.array(upper_HSV))
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (11, 11))
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+        image = cv2.bitwise_and(image, image, mask=mask)
+
+    return image
+
+
+def augment_image(image, rng, rotation_range=90, flip=True):
+    # Quarter turns and flips are free (views), any remaining angle is
+    # applied with a single warpAffine
+    if flip:
+        image = np.rot90(image, rng.integers(4))
+        if rng.random() < 0.5:
+            image = image[:, ::-1]
+
+    if rotation_range:
+        angle = rng.uniform(-rotation_range, rotation_range)
+        size = image.shape[0]
+        matrix = cv2.getRotationMatrix2D((size / 2, size / 2), angle, 1.0)
+        image = cv2.warpAffine(np.ascontiguousarray(image), matrix,
+                               (size, size), borderMode=cv2.BORDER_REFLECT)
+
+    return np.ascontiguousarray(image)
+
+
+# Memory maps of image caches opened by this (worker) process
+_open_caches = {}
+
+
+def _cached_images(cache_file, shape):
+    if cache_file not in _open_caches or \
+            _open_caches[cache_file].shape != shape:
+        _open_caches[cache_file] = np.memmap(cache_file, dtype=np.uint8,
+                                             mode='r', shape=shape)
+    return _open_caches[cache_file]
+
+
+def load_batch(image_paths, image_size, seed, augment=True, mask_HSV=None,
+               rotation_range=90, flip=True, cache=None):
+    # Runs in a worker process. Returns a uint8 (batch, size, size, 3) array;
+    # the conversion to float is left to the main process so less data has
+    # to be sent back. With cache=(cache_file, shape, rows) the images are
+    # read from an ImageCache instead of being decoded
+    rng = np.random.default_rng(seed)
+    batch = np.empty((len(image_paths), image_size, image_size, 3),
+                     dtype=np.uint8)
+
+    if cache is not None:
+        cache_file, shape, rows = cache
+        cached = _cached_images(cache_file, shape)
+
+    for i, image_path in enumerate(image_paths):
+        if cache is not None:
+            image = cached[rows[i]]
+        else:
+            image = load_image(image_path, image_size, mask_HSV)
+        if augment:
+            image = augment_image(image, rng, rotation_range, flip)
+        batch[i] = image
+
+    return batch
+
+
+class ImageBatchGenerator:
+    '''
+    Endless generator of (images, labels) batches for Keras fit_generator.
+    '''
+
+    def __init__(self, image_paths, labels=None, batch_size=64, image_size=150,
+                 augment=True, rotation_range=90, flip=True, mask_HSV=None,
+                 preprocessing_function=None, shuffle=True, n_workers=None,
+                 max_queued_batches=None, seed=42, image_cache=None):
+        self.image_paths = np.asarray(image_paths)
+        self.labels = None if labels is None else np.asarray(labels)
+        self.batch_size = batch_size
+        self.image_size = image_size
+        self.augment = augment
+        self.rotation_range = rotation_range
+        self.flip = flip
+        self.mask_HSV = mask_HSV
+        self.preprocessing_function = preprocessing_function
+        self.shuffle = shuffle
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.max_queued_batches = max_queued_batches or 2 * self.n_workers
+        self.seed = seed
+
+        # Read decoded images from an ImageCache rather than the PNGs
+        self.image_cache = image_cache
+        if image_cache is not None:
+            if image_cache.image_size != image_size:
+                raise ValueError('Cache holds {0}x{0} images'.format(
+                    image_cache.image_size))
+            # Cached rows are used as they are, so they must have been
+            # masked with the same thresholds
+            if np.asarray(image_cache.mask_HSV).tolist() != \
+                    np.asarray(mask_HSV).tolist():
+                raise ValueError('Cache was masked with mask_HSV={}, not '
+                                 '{}'.format(image_cache.mask_HSV, mask_HSV))
+            image_cache.update(image_paths)
+            self._cache_rows = image_cache.rows(image_paths)
+
+        if self.labels is not None and len(self.labels) != len(image_paths):
+            raise ValueError('Need one label per image')
+
+        self._pool = None
+        self._queued = deque()
+        self._batches = self._batch_indices()
+
+    def __len__(self):
+        # Batches per epoch
+        return int(np.ceil(len(self.image_paths) / self.batch_size))
+
+    def _batch_indices(self):
+        # Yields (batch seed, row indices) forever, reshuffling every epoch
+        rng = np.random.default_rng(self.seed)
+        epoch = 0
+        while True:
+            if self.shuffle:
+                order = rng.permutation(len(self.image_paths))
+            else:
+                order = np.arange(len(self.image_paths))
+            for i in range(len(self)):
+                rows = order[i * self.batch_size:(i + 1) * self.batch_size]
+                yield self.seed + epoch * len(self) + i, rows
+            epoch += 1
+
+    def _submit(self):
+        seed, rows = next(self._batches)
+        cache = None
+        if self.image_cache is not None:
+            cache = (self.image_cache.images_path,
+                     (self.image_cache.n_rows,) + self.image_cache.shape,
+                     self._cache_rows[rows])
+        result = self._pool.apply_async(
+            load_batch, (list(self.image_paths[rows]), self.image_size, seed,
+                         self.augment, self.mask_HSV, self.rotation_range,
+                         self.flip, cache))
+        self._queued.append((rows, result))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._pool is None:
+            self._pool = Pool(self.n_workers)
+
+        # Keep the queue of batches being prepared topped up
+        while len(self._queued) < self.max_queued_batches:
+            self._submit()
+
+        rows, result = self._queued.popleft()
+        images = result.get().astype(np.float32)
+
+        if self.preprocessing_function is not None:
+            images = self.preprocessing_function(images)
+
+        if self.labels is None:
+            return images
+        return images, self.labels[rows]
+
+    def close(self):
+        if getattr(self, '_pool', None) is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            self._queued.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        self.close()
@@ -0,0 +1,110 @@
+'''
+Ensemble the class probabilities of several models.
+
+combine_predictions weights and adds N (n_images, n_classes) probability
+matrices. search_weights scores a whole grid of weight vectors at once, in
+batched tensor operations instead of one call (and one Python loop over the
+rows) per weight, and returns the accuracy of every weight vector along with
+the best one.
+'''
+
+from itertools import combinations
+
+import numpy as np
+
+
+def _stack(probas):
+    # (n_models, n_images, n_classes)
+    probas = np.asarray(probas, dtype=np.float32)
+    if probas.ndim != 3:
+        raise ValueError('Expected a list of (n_images, n_classes) arrays')
+    return probas
+
+
+def combine_predictions(probas, weights, return_proba=False):
+    '''
+    Weighted sum of each model's probabilities, and the predicted class.
+    '''
+    probas = _stack(probas)
+    weights = np.asarray(weights, dtype=np.float32)
+    if weights.shape != (probas.shape[0],):
+        raise ValueError('Need one weight per model')
+
+    combined_proba = np.tensordot(weights, probas, axes=1)
+
+    if return_proba:
+        return combined_proba
+    return combined_proba.argmax(axis=1)
+
+
+def weight_grid(n_models, n_steps=19):
+    '''
+    Every weight vector on the simplex with weights in multiples of
+    1 / n_steps. For two models and n_steps=19 this is
+    np.linspace(0, 1, 20) and 1 minus it.
+    '''
+    # Stars and bars: choose where the n_models - 1 bars go among the
+    # n_steps + n_models - 1 slots
+    n_slots = n_steps + n_models - 1
+    bars = np.array(list(combinations(range(n_slots), n_models - 1)),
+                    dtype=np.int64).reshape(-1, n_models - 1)
+    edges = np.hstack([np.full((len(bars), 1), -1), bars,
+                       np.full((len(bars), 1), n_slots)])
+    counts = np.diff(edges, axis=1) - 1
+
+    return counts / n_steps
+
+
+def search_weights(probas, y, n_steps=19, weights=None, batch_size=256):
+    '''
+    Score every weight vector in a grid against the true labels y.
+
+    Returns (weights, scores, best_weights, best_score), where scores[i] is
+    the accuracy of weights[i]. Weight vectors are scored batch_size at a
+    time, so memory stays bounded for large grids.
+    '''
+    probas = _stack(probas)
+    y = np.asarray(y)
+
+    if weights is None:
+        weights = weight_grid(probas.shape[0], n_steps)
+    weights = np.asarray(weights, dtype=np.float32)
+
+    scores = np.empty(len(weights), dtype=np.float64)
+
+    for start in range(0, len(weights), batch_size):
+        batch = weights[start:start + batch_size]
+        # (n_weights, n_images, n_classes)
+        combined_proba = np.einsum('wm,mic->wic', batch, probas)
+        preds = combined_proba.argmax(axis=2)
+        scores[start:start + batch_size] = (preds == y).mean(axis=1)
+
+    best = scores.argmax()
+
+    return weights, scores, weights[best], scores[best]
+
+
+def stack_features(probas):
+    '''
+    Side by side probabilities of every model, as features for a meta-learner.
+    '''
+    probas = _stack(probas)
+    return probas.transpose(1, 0, 2).reshape(probas.shape[1], -1)
+
+
+def fit_stacker(probas, y, meta_model=None):
+    '''
+    Fit a meta-learner on the models' probabilities. Use probabilities on
+    held-out images (not the images the models were trained on).
+    '''
+    if meta_model is None:
+        from sklearn.linear_model import LogisticRegression
+        meta_model = LogisticRegression(solver='lbfgs', max_iter=300)
+
+    meta_model.fit(stack_features(probas), y)
+
+    return meta_model
+
+
+def stack_predictions(meta_model, probas):
+    return meta_model.predict(stack_features(probas))
@@ -0,0 +1,217 @@
+"""
+This file contains the FeatureStore class, an on-disk store of image features
+that replaces writing features to csv and ad hoc np.save files.
+
+A store is a folder holding:
+
+    meta.json : the model, depth and mask variant the features came from, the
+                number of features, the dtype and the number of rows
+    features.dat : the raw (n_rows, n_features) float32 or float16 matrix,
+                   opened as a read-only memory map, so reloading is instant
+                   and needs no parsing
+    filenames.npy, labels.npy : the filename (and optional label) of each row
+
+New images can be appended to an existing store. The feature rows are written
+before the row count in meta.json is updated, so an interrupted append leaves
+the store as it was.
+"""
+
+import json
+import os
+
+import numpy as np
+
+
+class FeatureStore:
+    """
+    Per-image feature rows keyed by filename, backed by a memory-mapped matrix.
+
+          Methods
+    ------------------
+        __init__(path, model, depth, variant, n_features, dtype):
+            --------------------------------
+            Open the store at path, creating it if it doesn't exist yet
+
+
+
+        append(features, filenames, labels):
+            --------------------------------
+            Add new rows to the store
+
+
+
+        missing(filenames):
+            --------------------------------
+            Return the filenames that aren't in the store yet
+
+
+
+        get(filenames):
+            --------------------------------
+            Return the feature rows for the given filenames
+
+    """
+
+    def __init__(self, path, model=None, depth=None, variant=None, n_features=None,
+                 dtype=None):
+        """
+        Initializer.
+
+        Parameters:
+        ----------
+            path : str
+                Folder holding the store
+
+            model : str
+                Name of the model the features came from, such as 'xception'
+
+            depth : int
+                Depth the model was decapitated to
+
+            variant : str
+                Which version of the images was featurized, such as 'mask'
+                or 'original'
+
+            n_features : int
+                Number of features per image. Only needed to create a new store
+
+            dtype : str
+                'float32' or 'float16'. A new store defaults to 'float32'
+
+        If the store already exists, any settings passed in must match the ones
+        it was created with.
+        """
+        self.path = path
+        self._meta_path = os.path.join(path, 'meta.json')
+        self._features_path = os.path.join(path, 'features.dat')
+        self._filenames_path = os.path.join(path, 'filenames.npy')
+        self._labels_path = os.path.join(path, 'labels.npy')
+
+        settings = {'model': model, 'depth': depth, 'variant': variant,
+                    'n_features': n_features,
+                    'dtype': None if dtype is None else np.dtype(dtype).name}
+
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, 'r') as f:
+                self.meta = json.load(f)
+            for key, value in settings.items():
+                if value is not None and self.meta[key] != value:
+                    raise ValueError('Store at {} has {}={!r}, not {!r}'.format(
+                        path, key, self.meta[key], value))
+        else:
+            if n_features is None:
+                raise ValueError('n_features is needed to create a new store.')
+            settings['dtype'] = settings['dtype'] or 'float32'
+            if settings['dtype'] not in ('float32', 'float16'):
+                raise ValueError('dtype must be float32 or float16.')
+            os.makedirs(path, exist_ok=True)
+            self.meta = dict(settings, n_rows=0)
+            if variant is None:
+                self.meta['variant'] = ''
+            open(self._features_path, 'wb').close()
+            self._write_array(self._filenames_path, np.array([], dtype=str))
+            self._write_array(self._labels_path, np.array([], dtype=str))
+            self._write_meta()
+
+        self._load_index()
+
+    def _write_atomic(self, path, write, mode='w'):
+        # Written next to path and swapped in, so a crash mid-write never
+        # leaves a truncated file behind
+        tmp_path = path + '.tmp'
+        with open(tmp_path, mode) as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+    def _write_meta(self):
+        self._write_atomic(self._meta_path, lambda f: json.dump(self.meta, f))
+
+    def _write_array(self, path, array):
+        self._write_atomic(path, lambda f: np.save(f, array), 'wb')
+
+    def _load_index(self):
+        n_rows = self.meta['n_rows']
+        self.filenames = np.load(self._filenames_path)[:n_rows]
+        self.labels = np.load(self._labels_path)[:n_rows]
+        self._rows = {name: i for i, name in enumerate(self.filenames)}
+
+    @property
+    def n_rows(self):
+        return self.meta['n_rows']
+
+    @property
+    def n_features(self):
+        return self.meta['n_features']
+
+    @property
+    def features(self):
+        """
+        The (n_rows, n_features) feature matrix, memory mapped read-only.
+        """
+        if self.n_rows == 0:
+            return np.zeros((0, self.n_features), dtype=self.meta['dtype'])
+        return np.memmap(self._features_path, dtype=self.meta['dtype'], mode='r',
+                         shape=(self.n_rows, self.n_features))
+
+    def __len__(self):
+        return self.n_rows
+
+    def __contains__(self, filename):
+        return filename in self._rows
+
+    def missing(self, filenames):
+        return [name for name in filenames if name not in self._rows]
+
+    def rows(self, filenames):
+        return np.array([self._rows[name] for name in filenames], dtype=np.int64)
+
+    def get(self, filenames):
+        return self.features[self.rows(filenames)]
+
+    def append(self, features, filenames, labels=None):
+        """
+        Append feature rows for new images.
+
+        Parameters:
+        ----------
+            features : numpy.ndarray
+                Array of shape (n_images, n_features)
+
+            filenames : list of str
+                The filename of each row. Must not already be in the store
+
+            labels : list of str
+                Optional label of each row, such as the class name
+        """
+        features = np.asarray(features, dtype=self.meta['dtype'])
+        filenames = [str(name) for name in filenames]
+
+        if features.ndim != 2 or features.shape[1] != self.n_features:
+            raise ValueError('features must have shape (n_images, {})'.format(self.n_features))
+        if features.shape[0] != len(filenames):
+            raise ValueError('Need one filename per row of features.')
+        if labels is None:
+            labels = [''] * len(filenames)
+        if len(labels) != len(filenames):
+            raise ValueError('Need one label per row of features.')
+
+        duplicates = [name for name in filenames if name in self._rows]
+        if duplicates or len(set(filenames)) != len(filenames):
+            raise ValueError('Filenames already in the store: {}'.format(duplicates[:5]))
+
+        # Drop any rows left over from an interrupted append, then add the
+        # new rows to the end of the matrix
+        row_bytes = self.n_features * np.dtype(self.meta['dtype']).itemsize
+        with open(self._features_path, 'r+b') as f:
+            f.truncate(self.n_rows * row_bytes)
+            f.seek(0, os.SEEK_END)
+            f.write(np.ascontiguousarray(features).tobytes())
+
+        self._write_array(self._filenames_path,
+                          np.concatenate([self.filenames, filenames]))
+        self._write_array(self._labels_path,
+                          np.concatenate([self.labels, [str(x) for x in labels]]))
+
+        self.meta['n_rows'] = self.n_rows + len(filenames)
+        self._write_meta()
+        self._load_index()
@@ -60,14 +60,49 @@ Functionality:
 
 import logging
 import os
+import threading
+from queue import Queue, Full
 
 import numpy as np
 import trafaret as t
 import pandas as pd
 
 from .build_featurizer import build_featurizer, supported_model_types
-from .feature_preprocessing import preprocess_data
+from .feature_preprocessing import preprocess_data, convert_single_image
 from .data_featurizing import featurize_data, _features_to_csv, _named_path_finder
+from .ragged_features import RaggedFeatures
+
+
+# Input size of each supported model
+SCALED_SIZES = {'squeezenet': (227, 227), 'vgg16': (224, 224), 'vgg19': (224, 224),
+                'resnet50': (224, 224), 'inceptionv3': (299, 299), 'xception': (299, 299)}
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff')
+
+# Featurizer models built so far in this process, keyed by
+# (model, depth, downsample_size, auto_sample). Building and decapitating a
+# model is slow, so it is only done once per key.
+_FEATURIZER_REGISTRY = {}
+
+
+def get_featurizer(depth, auto_sample, downsample_size, model_str):
+    """
+    Return the featurizer model for these settings, building it on first use.
+    """
+    key = (model_str, depth, downsample_size, auto_sample)
+    if key not in _FEATURIZER_REGISTRY:
+        logging.info("Building the featurizer.")
+        _FEATURIZER_REGISTRY[key] = build_featurizer(depth, auto_sample,
+                                                     downsample_size,
+                                                     model_str=model_str)
+    return _FEATURIZER_REGISTRY[key]
+
+
+def clear_featurizer_registry():
+    """
+    Drop every cached featurizer model, freeing its memory.
+    """
+    _FEATURIZER_REGISTRY.clear()
 
 
 class ImageFeaturizerMulti:
@@ -107,6 +142,20 @@ class ImageFeaturizerMulti:
             return the full dataframe
 
 
+
+        featurize_stream(image_path, batch_size, prefetch, out):
+            --------------------------------
+            Featurize an image directory batch by batch, decoding the next
+            batches in the background, without loading the whole directory
+
+
+
+        featurize_directories(directories, labels, stream):
+            --------------------------------
+            Featurize several image directories with the same model, and
+            return the features of each directory as RaggedFeatures
+
+
     """
 
     @t.guard(depth=t.Int(gte=1, lte=4),
@@ -122,8 +171,10 @@ class ImageFeaturizerMulti:
         """
         Initializer.
 
-        Loads an initial InceptionV3 pretrained network, decapitates it and
-        downsamples according to user specifications.
+        Saves the settings for an InceptionV3 pretrained network, decapitated
+        and downsampled according to user specifications. The network is built
+        the first time it is needed, and shared between featurizers with the
+        same model, depth and downsampling.
 
         Parameters:
         ----------
@@ -142,21 +193,12 @@ class ImageFeaturizerMulti:
         None. Initializes and saves the featurizer object attributes.
 
         """
-        # BUILDING THE MODEL #
-        logging.info("Building the featurizer.")
-
-        featurizer = build_featurizer(depth, auto_sample,
-                                      downsample_size, model_str=model.lower())
-
-        # Saving initializations of model
+        # The model itself is built lazily, and shared with every other
+        # featurizer in the process asking for the same model
         self.depth = depth
         self.auto_sample = auto_sample
         self.downsample_size = downsample_size
-        self.num_features = featurizer.layers[-1].output_shape[-1]
-        # Save the model
         self.model_name = model.lower()
-        self.featurizer = featurizer
-        self.visualize = featurizer.summary
 
         # Initializing preprocessing variables for after we load and featurize the images
         self.data = np.zeros((1))
@@ -173,6 +215,19 @@ class ImageFeaturizerMulti:
         self.number_crops = 0
         self.isotropic_scaling = False
 
+    @property
+    def featurizer(self):
+        return get_featurizer(self.depth, self.auto_sample,
+                              self.downsample_size, self.model_name)
+
+    @property
+    def num_features(self):
+        return self.featurizer.layers[-1].output_shape[-1]
+
+    @property
+    def visualize(self):
+        return self.featurizer.summary
+
     def load_and_featurize_data(self,
                                 image_column_headers,
                                 image_path='',
@@ -294,10 +349,7 @@ class ImageFeaturizerMulti:
             #
 
         """
-        size_dict = {'squeezenet': (227, 227), 'vgg16': (224, 224), 'vgg19': (224, 224),
-                     'resnet50': (224, 224), 'inceptionv3': (299, 299), 'xception': (299, 299)}
-
-        scaled_size = size_dict[self.model_name]
+        scaled_size = SCALED_SIZES[self.model_name]
 
         # Convert column header to list if it's passed a single string
         if isinstance(image_column_headers, str):
@@ -346,16 +398,18 @@ class ImageFeaturizerMulti:
         self.image_path = image_path
 
     @t.guard(save_features=t.Bool, omit_time=t.Bool, omit_model=t.Bool,
-             omit_depth=t.Bool, omit_output=t.Bool)
+             omit_depth=t.Bool, omit_output=t.Bool, write_csv=t.Bool)
     def featurize(self, save_features=False, omit_time=False, omit_model=False,
-                  omit_depth=False, omit_output=False):
+                  omit_depth=False, omit_output=False, write_csv=True):
         """
         Featurize the loaded data, returning the dataframe and writing the features
         and the full combined data to csv
 
         Parameters
         ----------
-        None, just operates on the loaded data
+            write_csv : bool
+                If False, skip writing the features to csv and only return them.
+                Use a FeatureStore to keep the features on disk instead
 
         Returns
         -------
@@ -398,8 +452,11 @@ class ImageFeaturizerMulti:
                           self.num_features] \
                 = partial_features = featurize_data(self.featurizer, self.data[column])
 
+            if not write_csv:
+                continue
+
             # Save the full dataframe to the csv
-            full_dataframe = _features_to_csv(self.data[column], partial_features, csv_path,
+            self.full_dataframe = _features_to_csv(self.data[column], partial_features, csv_path,
                                               self.image_column_headers[column], self.image_list,
                                               model_str=self.model_name, model_depth=self.depth,
                                               model_output=self.num_features,
@@ -407,5 +464,213 @@ class ImageFeaturizerMulti:
                                               omit_depth=omit_depth, omit_output=omit_output,
                                               save_features=save_features, continued_column=column)
 
-        self.full_dataframe = full_dataframe
         return self.features
+
+    def featurize_stream(self, image_path, batch_size=64, prefetch=2, grayscale=False,
+                         out=None, image_list=None):
+        """
+        Featurize every image in a directory, one batch at a time.
+
+        A background thread decodes and rescales the next batches while the
+        current one is featurized, so memory is bounded by
+        (prefetch + 1) * batch_size images rather than the size of the folder.
+        No csv is written.
+
+        Parameters
+        ----------
+            image_path : str
+                the path to the folder containing the images
+
+            batch_size : int
+                Number of images decoded and featurized at a time
+
+            prefetch : int
+                Number of decoded batches allowed to wait in the queue
+
+            grayscale : bool
+                Decides if image is grayscale or not
+
+            out : numpy.ndarray
+                Optional (n_images, num_features) array, such as a memmap, to
+                write the features into
+
+            image_list : list of str
+                Optional filenames within image_path to featurize, instead of
+                every image in the folder
+
+        Returns
+        -------
+            features : numpy.ndarray
+                Array of shape (n_images, num_features)
+
+        """
+        if image_list is None:
+            image_list = sorted(f for f in os.listdir(image_path)
+                                if f.lower().endswith(IMAGE_EXTENSIONS))
+        scaled_size = SCALED_SIZES[self.model_name]
+        n_images = len(image_list)
+
+        if out is None:
+            out = np.zeros((n_images, self.num_features), dtype=np.float32)
+        elif out.shape != (n_images, self.num_features):
+            raise ValueError('out must have shape {}'.format((n_images, self.num_features)))
+
+        batches = Queue(maxsize=prefetch)
+
+        # Set when the consumer stops, so the producer doesn't stay blocked on
+        # a full queue holding decoded batches
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for start in range(0, n_images, batch_size):
+                    if stop.is_set():
+                        return
+                    names = image_list[start:start + batch_size]
+                    batch = np.zeros((len(names),) + scaled_size + (1 if grayscale else 3,),
+                                     dtype=np.float32)
+                    for i, name in enumerate(names):
+                        image = convert_single_image('directory', self.model_name,
+                                                     os.path.join(image_path, name),
+                                                     scaled_size, grayscale)
+                        batch[i] = np.reshape(image, batch.shape[1:])
+                    if not put((start, batch)):
+                        return
+            except Exception as error:
+                put((None, error))
+                return
+            put((None, None))
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+
+        logging.info("Streaming {} images from {}.".format(n_images, image_path))
+
+        try:
+            while True:
+                start, batch = batches.get()
+                if start is None:
+                    if batch is not None:
+                        raise batch
+                    break
+                out[start:start + batch.shape[0]] = featurize_data(self.featurizer, batch)
+        finally:
+            # Also on errors: stop the producer, wait for it and drop any
+            # batches still queued
+            stop.set()
+            producer.join()
+            while not batches.empty():
+                batches.get_nowait()
+
+        self.features = out
+        self.image_list = [image_list]
+        self.image_path = image_path
+        self.scaled_size = scaled_size
+        return out
+
+    def featurize_to_store(self, store, image_path, label='', batch_size=64,
+                           grayscale=False):
+        """
+        Featurize the images in a directory that aren't in a FeatureStore yet,
+        and append them to the store.
+
+        Parameters
+        ----------
+            store : FeatureStore
+                Store created with this featurizer's model, depth and num_features
+
+            image_path : str
+                the path to the folder containing the images
+
+            label : str
+                Label saved with every image in the folder, such as the class name
+
+        Returns
+        -------
+            new_images : list of str
+                Filenames of the images added to the store
+
+        """
+        if (store.meta['model'], store.meta['depth'], store.n_features) != \
+                (self.model_name, self.depth, self.num_features):
+            raise ValueError('Store was created for a different featurizer.')
+
+        image_list = sorted(f for f in os.listdir(image_path)
+                            if f.lower().endswith(IMAGE_EXTENSIONS))
+        new_images = store.missing(image_list)
+
+        if new_images:
+            features = self.featurize_stream(image_path, batch_size=batch_size,
+                                             grayscale=grayscale, image_list=new_images)
+            store.append(features, new_images, [label] * len(new_images))
+
+        return new_images
+
+    def featurize_directories(self, directories, labels=None, grayscale=False,
+                              stream=False, batch_size=64):
+        """
+        Featurize several image directories with a single model build.
+
+        Parameters
+        ----------
+            directories : list of str
+                Paths to the image folders, such as one folder per class
+
+            labels : list of str
+                The label for the images in each directory. Defaults to the
+                directory names
+
+            stream : bool
+                If True, featurize each directory with featurize_stream rather
+                than loading it all into memory first
+
+            batch_size : int
+                Number of images per batch when streaming
+
+        Returns
+        -------
+            features : RaggedFeatures
+                One block of features per directory, in a single contiguous
+                buffer. features.matrix is the 2D array of every image,
+                features.labels the label of each row, and features[label]
+                the rows of one directory
+
+        """
+        if labels is None:
+            labels = [os.path.basename(os.path.normpath(directory))
+                      for directory in directories]
+        if len(labels) != len(directories):
+            raise ValueError('Need one label per directory.')
+
+        if not stream:
+            blocks = []
+            for directory, label in zip(directories, labels):
+                logging.info("Featurizing {}".format(directory))
+                self.load_data(label, image_path=directory, grayscale=grayscale)
+                blocks.append(self.featurize(write_csv=False))
+            return RaggedFeatures.from_blocks(blocks, labels)
+
+        # When streaming, the images are counted first so every directory can
+        # write its features straight into its block of the shared buffer
+        image_lists = [sorted(f for f in os.listdir(directory)
+                              if f.lower().endswith(IMAGE_EXTENSIONS))
+                       for directory in directories]
+        features = RaggedFeatures.empty([len(image_list) for image_list in image_lists],
+                                        self.num_features, labels)
+
+        for i, (directory, image_list) in enumerate(zip(directories, image_lists)):
+            logging.info("Featurizing {}".format(directory))
+            self.featurize_stream(directory, batch_size=batch_size, grayscale=grayscale,
+                                  out=features.block(i), image_list=image_list)
+
+        self.features = features.matrix
+        return features
@@ -0,0 +1,147 @@
+"""
+This file contains the RaggedFeatures class, a container for blocks of
+features with a different number of rows each, such as one block of image
+features per class folder.
+
+All blocks live in one contiguous (n_images, n_features) buffer, with an array
+of offsets marking where each block starts. The full 2D matrix, a block, and
+the label of every row are all available without copying the features, which
+replaces building object arrays of per-class blocks and flattening them with
+nested Python loops.
+"""
+
+import numpy as np
+
+
+class RaggedFeatures:
+    """
+    Blocks of feature rows backed by a single contiguous buffer.
+
+          Methods
+    ------------------
+        from_blocks(blocks, labels):
+            --------------------------------
+            Build the container from a list (or object array) of 2D blocks
+
+
+
+        empty(sizes, n_features, labels, dtype):
+            --------------------------------
+            Allocate the buffer up front, to be filled block by block
+
+
+
+        block(key):
+            --------------------------------
+            View of the rows of one block, by position or label
+
+    """
+
+    def __init__(self, buffer, offsets, block_labels):
+        """
+        Initializer.
+
+        Parameters:
+        ----------
+            buffer : numpy.ndarray
+                Array of shape (n_images, n_features) holding every block
+
+            offsets : numpy.ndarray
+                n_blocks + 1 row offsets; block i is buffer[offsets[i]:offsets[i + 1]]
+
+            block_labels : list of str
+                The label of each block
+        """
+        offsets = np.asarray(offsets, dtype=np.int64)
+
+        if buffer.ndim != 2:
+            raise ValueError('buffer must be 2D')
+        if offsets[0] != 0 or offsets[-1] != buffer.shape[0] or np.any(np.diff(offsets) < 0):
+            raise ValueError('offsets must rise from 0 to the number of rows')
+        if len(block_labels) != len(offsets) - 1:
+            raise ValueError('Need one label per block')
+
+        self.buffer = buffer
+        self.offsets = offsets
+        self.block_labels = np.asarray(block_labels)
+        self._positions = {label: i for i, label in enumerate(self.block_labels)}
+
+    @classmethod
+    def empty(cls, sizes, n_features, block_labels, dtype=np.float32):
+        offsets = np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)])
+        buffer = np.zeros((offsets[-1], n_features), dtype=dtype)
+        return cls(buffer, offsets, block_labels)
+
+    @classmethod
+    def from_blocks(cls, blocks, block_labels=None, dtype=None):
+        """
+        Copy a list of 2D blocks into one buffer, once.
+
+        Also accepts the object arrays of per-class blocks saved by earlier
+        versions with np.save.
+        """
+        blocks = [np.asarray(block) for block in blocks]
+        if block_labels is None:
+            block_labels = [str(i) for i in range(len(blocks))]
+        if dtype is None:
+            dtype = blocks[0].dtype if blocks else np.float32
+        n_features = blocks[0].shape[1] if blocks else 0
+
+        ragged = cls.empty([len(block) for block in blocks], n_features,
+                           block_labels, dtype)
+        for i, block in enumerate(blocks):
+            ragged.block(i)[:] = block
+
+        return ragged
+
+    def __len__(self):
+        return len(self.block_labels)
+
+    @property
+    def n_rows(self):
+        return self.buffer.shape[0]
+
+    @property
+    def sizes(self):
+        return np.diff(self.offsets)
+
+    @property
+    def matrix(self):
+        """
+        Every block stacked as one (n_images, n_features) array. Not a copy.
+        """
+        return self.buffer
+
+    @property
+    def block_ids(self):
+        """
+        The block number of every row.
+        """
+        return np.repeat(np.arange(len(self), dtype=np.int32), self.sizes)
+
+    @property
+    def labels(self):
+        """
+        The block label of every row.
+        """
+        return self.block_labels[self.block_ids]
+
+    def block(self, key):
+        """
+        View of the rows of a block, given its position or its label.
+        """
+        if not isinstance(key, (int, np.integer)):
+            key = self._positions[key]
+        return self.buffer[self.offsets[key]:self.offsets[key + 1]]
+
+    def __getitem__(self, key):
+        return self.block(key)
+
+    def items(self):
+        for i, label in enumerate(self.block_labels):
+            yield label, self.block(i)
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.buffer
+        return self.buffer.astype(dtype)
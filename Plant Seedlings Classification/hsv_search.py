@@ -0,0 +1,217 @@
+'''
+HSV threshold search for finding the plant in a seedling image.
+
+Follows the same stopping rules as find_shapes -> tune_sat -> tune_hue from
+Seedlings_v6: widen the hue window, then lower the saturation floor, then
+shrink min_shape_size until the number of contours falls inside
+[contour_threshold_lower, contour_threshold_upper].
+
+The linear sweep rebuilds the mask (inRange, morphologyEx, findContours) at
+every step, and the outer min_shape_size loop rebuilds the very same masks
+again. Here the masks of a whole hue sweep come from one closing of a
+per-pixel map of the step at which each pixel enters the hue window (see
+HueSweep), so a step is a threshold and a findContours call, and the closing
+is only redone when the saturation floor changes. Each distinct mask is
+evaluated once and its contour areas are cached, so counting contours for
+any min_shape_size is a lookup. The steps taken, and so the masks and
+thresholds returned, are exactly those of the linear sweep.
+'''
+
+import numpy as np
+import cv2
+
+# Search steps, as in Seedlings_v6
+HUE_STEP = 2
+MIN_HUE = 20
+SAT_STEP = 5
+MIN_SAT = 45
+SHAPE_SIZE_STEP = 200
+MIN_SHAPE_SIZE = 50
+
+
+def sharpen_image(image):
+    image_blurred = cv2.bilateralFilter(image, 9, 75, 75)
+    image_sharp = cv2.addWeighted(image, 1.5, image_blurred, -0.5, 0)
+    return image_sharp
+
+
+class HueSweep:
+    '''
+    The closed masks of every step of one hue sweep: fixed saturation and
+    value bounds, and the hue window widened by HUE_STEP on both sides at
+    each step.
+
+    Each pixel gets the first step at which it enters the window (its entry
+    step). The mask of step k is entry <= k, and closing it with a flat
+    kernel is the same as thresholding the grayscale closing of the entry
+    map (a minimum then a maximum filter) at k. So one erode / dilate pair
+    gives the closed mask of every step, and a step only costs a threshold
+    and findContours.
+    '''
+
+    def __init__(self, image, upper_HSV, lower_HSV, n_steps, kernel):
+        hue, sat, value = cv2.split(image)
+        hue = hue.astype(np.int16)
+
+        outside = np.maximum(np.maximum(lower_HSV[0] - hue,
+                                        hue - upper_HSV[0]), 0)
+        entry = (outside + HUE_STEP - 1) // HUE_STEP
+
+        inside = (sat >= lower_HSV[1]) & (sat <= upper_HSV[1]) & \
+            (value >= lower_HSV[2]) & (value <= upper_HSV[2]) & \
+            (entry < n_steps)
+        entry = np.where(inside, entry, 255).astype(np.uint8)
+
+        self.closed = cv2.dilate(cv2.erode(entry, kernel), kernel)
+
+        # Masks are nested, so the pixel count identifies the mask of a step
+        self.sizes = np.cumsum(np.bincount(self.closed.ravel(),
+                                           minlength=256))
+        self.masks = {}
+        self.n_contour_passes = 0
+
+    def evaluate(self, step):
+        # Returns (mask, contours, sorted contour areas) of step
+        key = self.sizes[step]
+
+        if key not in self.masks:
+            self.n_contour_passes += 1
+            mask = cv2.threshold(self.closed, step, 255,
+                                 cv2.THRESH_BINARY_INV)[1]
+            contours = cv2.findContours(mask, cv2.RETR_TREE,
+                                        cv2.CHAIN_APPROX_SIMPLE)[-2]
+            areas = np.sort([cv2.contourArea(c) for c in contours])
+            self.masks[key] = (mask, contours, areas)
+
+        return self.masks[key]
+
+    def count_contours(self, step, min_shape_size):
+        _, _, areas = self.evaluate(step)
+        return len(areas) - np.searchsorted(areas, min_shape_size, 'left')
+
+
+class MaskCache:
+    '''
+    The hue sweeps of a single HSV image, one per saturation floor, kept
+    across min_shape_size rounds.
+    '''
+
+    def __init__(self, image):
+        self.image = image
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (11, 11))
+        self.sweeps = {}
+
+    def sweep(self, upper_HSV, lower_HSV, n_steps):
+        key = (tuple(upper_HSV), tuple(lower_HSV), n_steps)
+        if key not in self.sweeps:
+            self.sweeps[key] = HueSweep(self.image, upper_HSV, lower_HSV,
+                                        n_steps, self.kernel)
+        return self.sweeps[key]
+
+    @property
+    def n_evaluations(self):
+        # Masks built with an erode / dilate pair, one per sweep
+        return len(self.sweeps)
+
+    @property
+    def n_contour_passes(self):
+        return sum(sweep.n_contour_passes for sweep in self.sweeps.values())
+
+
+def _in_window(count, lower, upper):
+    return lower <= count <= upper
+
+
+def _hue_steps(lower_hue):
+    # Steps tune_hue takes before the lower hue drops below MIN_HUE
+    return max(1, (lower_hue - MIN_HUE) // HUE_STEP + 1)
+
+
+def find_shapes(image, upper_HSV, lower_HSV, min_shape_size=700,
+                contour_threshold_upper=3, contour_threshold_lower=1,
+                return_cache=False):
+    '''
+    Mask the plant in a BGR image.
+
+    Returns the masked (HSV) image, its contours and the final upper and
+    lower HSV thresholds, the same as Seedlings_v6 find_shapes.
+    '''
+    upper_HSV = [int(x) for x in upper_HSV]
+    lower_HSV = [int(x) for x in lower_HSV]
+
+    image = cv2.resize(image, (300, 300))
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    image = sharpen_image(image)
+
+    cache = MaskCache(image)
+
+    init_hue_upper, init_hue_lower = upper_HSV[0], lower_HSV[0]
+    init_sat_lower = lower_HSV[1]
+    n_steps = _hue_steps(init_hue_lower)
+
+    while True:
+        # tune_sat
+        while True:
+            # tune_hue: stops strictly inside the window
+            sweep = cache.sweep(upper_HSV, lower_HSV, n_steps)
+            for step in range(n_steps):
+                count = sweep.count_contours(step, min_shape_size)
+                if contour_threshold_lower < count < contour_threshold_upper:
+                    break
+            evaluated = (sweep, step)
+
+            lower_HSV[0] = init_hue_lower - HUE_STEP * (step + 1)
+            upper_HSV[0] = init_hue_upper + HUE_STEP * (step + 1)
+
+            if _in_window(count, contour_threshold_lower,
+                          contour_threshold_upper):
+                break
+
+            lower_HSV[1] -= SAT_STEP
+            upper_HSV[0] = init_hue_upper
+            lower_HSV[0] = init_hue_lower
+
+            if lower_HSV[1] <= MIN_SAT:
+                break
+
+        min_shape_size -= SHAPE_SIZE_STEP
+
+        if _in_window(count, contour_threshold_lower,
+                      contour_threshold_upper):
+            break
+
+        lower_HSV[1] = init_sat_lower
+
+        if min_shape_size < MIN_SHAPE_SIZE:
+            print('No contours found')
+            break
+
+    sweep, step = evaluated
+    mask, contours, _ = sweep.evaluate(step)
+    processed_image = cv2.bitwise_and(image, image, mask=mask)
+
+    if return_cache:
+        return processed_image, contours, upper_HSV, lower_HSV, cache
+
+    return processed_image, contours, upper_HSV, lower_HSV
+
+
+class HSVSearchFilter:
+    '''
+    Drop-in for ImageFilter(image, upper_HSV, lower_HSV).find_shapes()
+    using the cached threshold search.
+    '''
+
+    def __init__(self, image, upper_HSV, lower_HSV):
+        self.image = image
+        self.upper_HSV = upper_HSV
+        self.lower_HSV = lower_HSV
+        self.min_shape_size = 700
+        self.contour_threshold_upper = 3
+        self.contour_threshold_lower = 1
+
+    def find_shapes(self):
+        return find_shapes(self.image, self.upper_HSV, self.lower_HSV,
+                           self.min_shape_size,
+                           self.contour_threshold_upper,
+                           self.contour_threshold_lower)
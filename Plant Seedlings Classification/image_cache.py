@@ -0,0 +1,162 @@
+'''
+Persistent cache of decoded, resized (and optionally masked) images.
+
+Every Seedlings version re-reads each PNG with cv2.imread and resizes it
+before any modelling starts. ImageCache does that once: images are stored as
+one uint8 (n_images, size, size, 3) file, memory mapped read-only by later
+runs, so several experiment processes share the same pages instead of each
+decoding the dataset again.
+
+Each cache folder holds one image size and mask variant. The index records
+the mask_HSV thresholds the images were masked with, and the source path and
+mtime of every row; update() only decodes images that are new or have
+changed since they were cached.
+
+    cache = ImageCache('.../Seedlings/cache', image_size=299)
+    cache.update(train_paths)
+    images = cache.get(train_paths)
+'''
+
+import os
+import json
+from multiprocessing import Pool
+
+import numpy as np
+
+from atomic import write_json
+from augmentation import load_image
+
+# Save the index after this many decoded images
+CHECKPOINT_EVERY = 500
+
+
+def _decode(args):
+    image_path, image_size, mask_HSV = args
+    return load_image(image_path, image_size, mask_HSV)
+
+
+class ImageCache:
+
+    def __init__(self, cache_dir, image_size, variant='original',
+                 mask_HSV=None):
+        '''
+        variant names the kind of images cached, such as 'original' or
+        'mask'. Use a different variant for each set of mask_HSV thresholds;
+        opening a cache with other thresholds than it was built with raises
+        a ValueError.
+        '''
+        self.image_size = image_size
+        self.variant = variant
+        self.mask_HSV = mask_HSV
+        self.path = os.path.join(cache_dir,
+                                 '{}_{}'.format(variant, image_size))
+        self.shape = (image_size, image_size, 3)
+
+        self._index_path = os.path.join(self.path, 'index.json')
+        self.images_path = os.path.join(self.path, 'images.dat')
+
+        # As stored in the index: nested lists (or None)
+        mask_HSV = np.asarray(mask_HSV).tolist()
+
+        if os.path.exists(self._index_path):
+            with open(self._index_path, 'r') as f:
+                self.index = json.load(f)
+            if self.index.get('mask_HSV') != mask_HSV:
+                raise ValueError(
+                    'Cache at {} was masked with mask_HSV={}, not {}; use '
+                    'another variant'.format(self.path,
+                                             self.index.get('mask_HSV'),
+                                             mask_HSV))
+        else:
+            os.makedirs(self.path, exist_ok=True)
+            open(self.images_path, 'wb').close()
+            self.index = {'image_size': image_size, 'variant': variant,
+                          'mask_HSV': mask_HSV, 'n_rows': 0, 'images': {}}
+            self._save_index()
+
+    @property
+    def n_rows(self):
+        return self.index['n_rows']
+
+    def _save_index(self):
+        write_json(self._index_path, self.index)
+
+    def is_cached(self, image_path):
+        entry = self.index['images'].get(os.path.abspath(image_path))
+        return entry is not None and \
+            entry[1] == os.path.getmtime(image_path)
+
+    @property
+    def images(self):
+        '''
+        Every cached image, memory mapped read-only.
+        '''
+        if self.n_rows == 0:
+            return np.zeros((0,) + self.shape, dtype=np.uint8)
+        return np.memmap(self.images_path, dtype=np.uint8, mode='r',
+                         shape=(self.n_rows,) + self.shape)
+
+    def rows(self, image_paths):
+        return np.array([self.index['images'][os.path.abspath(p)][0]
+                         for p in image_paths], dtype=np.int64)
+
+    def get(self, image_paths):
+        return self.images[self.rows(image_paths)]
+
+    def update(self, image_paths, n_workers=None, chunk_size=16):
+        '''
+        Decode and cache every image that is new or changed since it was
+        cached. Returns the number of images decoded.
+        '''
+        stale = [p for p in image_paths if not self.is_cached(p)]
+
+        if not stale:
+            return 0
+
+        images = self.index['images']
+        row_bytes = int(np.prod(self.shape))
+
+        # Changed images keep their row; new images are added at the end
+        rows = []
+        n_rows = self.n_rows
+        for image_path in stale:
+            entry = images.get(os.path.abspath(image_path))
+            if entry is None:
+                rows.append(n_rows)
+                n_rows += 1
+            else:
+                rows.append(entry[0])
+
+        with open(self.images_path, 'r+b') as f:
+            f.truncate(n_rows * row_bytes)
+
+        cache = np.memmap(self.images_path, dtype=np.uint8, mode='r+',
+                          shape=(n_rows,) + self.shape)
+
+        print('Caching {} images'.format(len(stale)))
+
+        # mtime from before the image is decoded, so an image changed
+        # meanwhile is decoded again next time
+        mtimes = [os.path.getmtime(p) for p in stale]
+        jobs = [(p, self.image_size, self.mask_HSV) for p in stale]
+        n_done_rows = self.n_rows
+
+        with Pool(n_workers or os.cpu_count() or 1) as pool:
+            decoded = pool.imap(_decode, jobs, chunksize=chunk_size)
+            for i, image in enumerate(decoded):
+                cache[rows[i]] = image
+                images[os.path.abspath(stale[i])] = [rows[i], mtimes[i]]
+                n_done_rows = max(n_done_rows, rows[i] + 1)
+
+                if (i + 1) % CHECKPOINT_EVERY == 0:
+                    cache.flush()
+                    self.index['n_rows'] = n_done_rows
+                    self._save_index()
+
+        cache.flush()
+        del cache
+
+        self.index['n_rows'] = n_rows
+        self._save_index()
+
+        return len(stale)
@@ -0,0 +1,211 @@
+'''
+Parallel, resumable masking of the seedling images.
+
+Each image is read, masked with the HSV threshold search and written to the
+mask folder by a pool of worker processes. A manifest of the source image
+mtime and size is kept next to the mask folder, so re-running only masks new
+or changed images.
+
+On Windows, call mask_folder from inside an `if __name__ == "__main__":`
+block, pass n_workers=1 (which masks in this process, without spawning
+workers), or run this file directly:
+
+    python image_masking.py .../Seedlings/train .../Seedlings/train_mask
+    python image_masking.py .../Seedlings/test .../Seedlings/test_mask \\
+        --no-class-folders
+'''
+
+import os
+import json
+from glob import glob
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, \
+    wait, FIRST_COMPLETED
+
+import cv2
+
+from atomic import write_json
+
+# Cached version of the ImageFilter / find_shapes threshold search
+from hsv_search import HSVSearchFilter
+
+# Starting point for finding green plants
+UPPER_HSV_INIT = [48, 255, 255]
+LOWER_HSV_INIT = [24, 27, 15]
+MIN_SHAPE_SIZE = 150
+
+# Save the manifest after this many masked images
+CHECKPOINT_EVERY = 100
+
+# Bump when the masking changes, so existing masks are redone
+MASK_VERSION = 2
+
+
+def mask_image(image_path, save_path):
+    # Read in the image in color
+    image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+
+    # Apply the adjustable filter to mask the image
+    image_filter = HSVSearchFilter(image=image,
+                                   upper_HSV=list(UPPER_HSV_INIT),
+                                   lower_HSV=list(LOWER_HSV_INIT))
+    image_filter.min_shape_size = MIN_SHAPE_SIZE
+
+    processed_image, contours, upper_HSV, lower_HSV =\
+        image_filter.find_shapes()
+
+    # A failed write must not be stamped as done in the manifest
+    if not cv2.imwrite(save_path, processed_image):
+        raise IOError('Could not write {}'.format(save_path))
+
+    return image_path
+
+
+def find_mask_jobs(source_folder, mask_folder, class_folders=True):
+    # List (image_path, save_path) pairs, one class sub-folder at a time if
+    # the source folder is split by class
+    if class_folders:
+        folders = [(os.path.join(source_folder, name),
+                    os.path.join(mask_folder, name))
+                   for name in sorted(os.listdir(source_folder))
+                   if os.path.isdir(os.path.join(source_folder, name))]
+    else:
+        folders = [(source_folder, mask_folder)]
+
+    jobs = []
+
+    for folder, save_folder in folders:
+        os.makedirs(save_folder, exist_ok=True)
+        for image_path in sorted(glob(os.path.join(folder, '*.png'))):
+            save_path = os.path.join(save_folder,
+                                     os.path.basename(image_path) + '.png')
+            jobs.append((image_path, save_path))
+
+    return jobs
+
+
+def manifest_path_for(mask_folder):
+    # Kept beside, not inside, the mask folder so os.listdir(mask_folder)
+    # still only returns class folders
+    return mask_folder.rstrip('/\\') + '_manifest.json'
+
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_path):
+    # Atomic, so a crash never leaves a partial manifest behind
+    write_json(manifest_path, manifest)
+
+
+def _source_stamp(image_path):
+    stat = os.stat(image_path)
+    return {'mtime': stat.st_mtime, 'size': stat.st_size,
+            'version': MASK_VERSION}
+
+
+def _is_up_to_date(image_path, save_path, manifest):
+    entry = manifest.get(image_path)
+    if entry is None or not os.path.exists(save_path):
+        return False
+    return entry == _source_stamp(image_path)
+
+
+def mask_images(jobs, manifest_path, n_workers=None, max_in_flight=None):
+    '''
+    Mask every (image_path, save_path) job that isn't already up to date.
+
+    n_workers defaults to the number of cores, and at most max_in_flight
+    images (default 4 per worker) are queued in the pool at any one time.
+    With n_workers=1 no processes are started; images are masked on a
+    thread of this process. Returns the list of image paths that failed to
+    mask.
+    '''
+    manifest = load_manifest(manifest_path)
+
+    pending = [(image_path, save_path) for image_path, save_path in jobs
+               if not _is_up_to_date(image_path, save_path, manifest)]
+
+    print('Masking {} of {} images'.format(len(pending), len(jobs)))
+
+    if not pending:
+        return []
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    if max_in_flight is None:
+        max_in_flight = 4 * n_workers
+
+    failed = []
+    n_done = 0
+    jobs_iter = iter(pending)
+
+    executor_class = ProcessPoolExecutor if n_workers > 1 \
+        else ThreadPoolExecutor
+
+    with executor_class(max_workers=n_workers) as executor:
+        in_flight = {}
+
+        while True:
+            # Top up the pool, keeping the number of queued images bounded
+            while len(in_flight) < max_in_flight:
+                job = next(jobs_iter, None)
+                if job is None:
+                    break
+                image_path, save_path = job
+                # Stamp the source before masking, so an image changed
+                # mid-run is picked up again next time
+                stamp = _source_stamp(image_path)
+                future = executor.submit(mask_image, image_path, save_path)
+                in_flight[future] = (image_path, stamp)
+
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                image_path, stamp = in_flight.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    print('Failed to mask {}: {}'.format(image_path, e))
+                    failed.append(image_path)
+                    continue
+
+                manifest[image_path] = stamp
+                n_done += 1
+
+                if n_done % CHECKPOINT_EVERY == 0:
+                    save_manifest(manifest, manifest_path)
+                    print('Masked {} / {}'.format(n_done, len(pending)))
+
+    save_manifest(manifest, manifest_path)
+
+    return failed
+
+
+def mask_folder(source_folder, mask_folder, class_folders=True,
+                n_workers=None, max_in_flight=None):
+    jobs = find_mask_jobs(source_folder, mask_folder, class_folders)
+    return mask_images(jobs, manifest_path_for(mask_folder),
+                       n_workers=n_workers, max_in_flight=max_in_flight)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Mask seedling images')
+    parser.add_argument('source_folder')
+    parser.add_argument('mask_folder')
+    parser.add_argument('--no-class-folders', dest='class_folders',
+                        action='store_false',
+                        help='source folder is not split by class (test)')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    mask_folder(args.source_folder, args.mask_folder,
+                class_folders=args.class_folders, n_workers=args.workers)
@@ -0,0 +1,47 @@
+'''
+Write Kaggle submission files.
+
+Class ids are mapped to species names by indexing a precomputed array, and
+the submission is built as one sorted frame and written to csv in chunks.
+'''
+
+import numpy as np
+import pandas as pd
+
+
+def class_names_array(label_to_id_dict):
+    # Array where class_names[id] is the class name
+    class_names = np.empty(len(label_to_id_dict), dtype=object)
+    for name, class_id in label_to_id_dict.items():
+        class_names[class_id] = name
+    return class_names
+
+
+def build_submission(preds, filenames, class_names):
+    class_names = np.asarray(class_names)
+    preds = np.asarray(preds, dtype=np.int64)
+    filenames = np.asarray(filenames)
+
+    if len(preds) != len(filenames):
+        raise ValueError('Need one filename per prediction')
+
+    order = np.argsort(filenames, kind='stable')
+
+    return pd.DataFrame({'file': filenames[order],
+                         'species': class_names[preds[order]]})
+
+
+def write_submission(preds, filenames, class_names, csv_filename,
+                     chunk_size=100000):
+    '''
+    Write a file,species csv sorted by file. class_names can be an array
+    indexed by class id, or a dict of class name to id.
+    '''
+    if isinstance(class_names, dict):
+        class_names = class_names_array(class_names)
+
+    submission = build_submission(preds, filenames, class_names)
+
+    submission.to_csv(csv_filename, index=False, chunksize=chunk_size)
+
+    return submission